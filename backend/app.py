@@ -1,7 +1,9 @@
 # fmt: off
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_jwt_extended import JWTManager
 from dotenv import load_dotenv
+import multiprocessing
 from extensions import socketio  # Import socketio from extensions.py
 from database import db, fs  # Import from the new database module
 import os
@@ -11,6 +13,11 @@ load_dotenv()
 app = Flask(__name__)
 app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "your-secret-key")
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = 3600
+# Reverse proxies in front of the app (0 if clients connect directly). Unset,
+# client IPs can't be trusted and logins are only throttled per account.
+if os.getenv("TRUSTED_PROXIES") is not None:
+    app.config["TRUSTED_PROXIES"] = int(os.getenv("TRUSTED_PROXIES"))
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
 
 jwt = JWTManager(app)
 
@@ -18,15 +25,26 @@ jwt = JWTManager(app)
 from auth import auth_bp
 from classes import classes_bp
 from notes import notes_bp
-from quizzes import quizzes_bp
+from quizzes import quizzes_bp, start_batch_poller
 from chat import chat_bp
+from avatars import avatars_bp
+from revocation import init_revocation, start_revocation_sync
+from gemini_client import start_metrics_logger
 
 app.register_blueprint(auth_bp, url_prefix="/auth")
 app.register_blueprint(classes_bp, url_prefix="/classes")
 app.register_blueprint(notes_bp, url_prefix="/notes")
 app.register_blueprint(quizzes_bp, url_prefix="/quizzes")
 app.register_blueprint(chat_bp, url_prefix="/chat")
+app.register_blueprint(avatars_bp, url_prefix="/users")
 
+init_revocation(jwt)
+# Spawned pool workers (e.g. banner transforms) re-run this script on start-up;
+# only the server process runs the background threads
+if multiprocessing.current_process().name == "MainProcess":
+    start_revocation_sync()
+    start_batch_poller()
+    start_metrics_logger()
 socketio.init_app(app)
 
 if __name__ == "__main__":
@@ -1,13 +1,69 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_jwt
 from bson import ObjectId
 from datetime import datetime
 from database import db, fs  # Import db and fs from database.py
+from ttl_cache import TTLCache
+from passwords import hash_password, verify_password, needs_rehash, rehash_later
+from passwords import login_throttled, login_delay, record_login_failure, clear_login_failures
+from revocation import revoke, mark_identity_changed, identity_changed_at
+from avatars import process_avatar
+from jobs import executor
 from functools import wraps
+import time
+import os
 
 auth_bp = Blueprint("auth", __name__)
 
+# Identity fields of users whose token doesn't carry them (or can't be trusted),
+# stored as (load time, identity)
+identity_cache = TTLCache(int(os.getenv("IDENTITY_CACHE_SIZE", "10000")),
+                          int(os.getenv("IDENTITY_CACHE_TTL", "300")))
+
+
+def identity_claims(user):
+    """Stable identity fields embedded in access tokens as additional claims."""
+    return {"role": user["role"], "username": user["username"]}
+
+
+def load_identity(user_id):
+    """
+    The user's identity fields, from the cache or the database; None if the
+    user is gone. Cached identities loaded before the user's last identity
+    change are reloaded.
+    """
+    user_id = str(user_id)
+    cached = identity_cache.get(user_id)
+    if cached and cached[0] > identity_changed_at(user_id):
+        return cached[1]
+    loaded_at = time.time()
+    user = db.users.find_one({"_id": ObjectId(user_id)}, {"role": 1, "username": 1})
+    if not user:
+        return None
+    identity = identity_claims(user)
+    identity_cache.set(user_id, (loaded_at, identity))
+    return identity
+
+
+def invalidate_identity(user_id):
+    """
+    Call after changing a user's role or other identity fields: every worker
+    stops trusting the claims of tokens issued before now, and its cached
+    identity, within REVOCATION_SYNC_INTERVAL seconds.
+    """
+    mark_identity_changed(user_id)
+    identity_cache.invalidate(str(user_id))
+
+
+def current_role():
+    """The role of the request's user, read from the token when it can be trusted."""
+    user_id = get_jwt_identity()
+    claims = get_jwt()
+    if "role" in claims and claims.get("iat", 0) > identity_changed_at(user_id):
+        return claims["role"]
+    identity = load_identity(user_id)
+    return identity["role"] if identity else None
+
 
 @auth_bp.route("/signup", methods=["POST"])
 def signup():
@@ -26,17 +82,22 @@ def signup():
     pfp_file = request.files.get("pfp")
     pfp_id = fs.put(pfp_file) if pfp_file else None
 
-    password_hash = generate_password_hash(password)
+    password_hash = hash_password(password)
     user = {
         "username": username,
         "email": email,
         "password_hash": password_hash,
         "role": role,
         "pfp": pfp_id,
+        # The raw upload is normalized into sized WebP variants in the background
+        "pfpStatus": "pending" if pfp_id else None,
         "created_at": datetime.utcnow()
     }
     user_id = db.users.insert_one(user).inserted_id
-    token = create_access_token(identity=str(user_id))
+    if pfp_id:
+        executor.submit(process_avatar, user_id, pfp_id)
+    token = create_access_token(identity=str(user_id),
+                                additional_claims=identity_claims(user))
     return jsonify({"token": token}), 201
 
 
@@ -45,13 +106,38 @@ def login():
     data = request.json
     email = data["email"]
     password = data["password"]
-    user = db.users.find_one({"email": email})
+    # Behind an unconfigured proxy every client shares the proxy's address
+    ip = None
+    if current_app.config.get("TRUSTED_PROXIES") is not None:
+        ip = request.remote_addr or "unknown"
+    if login_throttled(ip, email):
+        return jsonify({"error": "Too many failed attempts, try again later"}), 429
+    # Slows down guessing at one account without refusing its owner
+    time.sleep(login_delay(email))
 
-    if not user or not check_password_hash(user["password_hash"], password):
+    user = db.users.find_one({"email": email})
+    if not user or not verify_password(user["password_hash"], password):
+        record_login_failure(ip, email)
         return jsonify({"error": "Invalid credentials"}), 401
+    clear_login_failures(ip, email)
+
+    if needs_rehash(user["password_hash"]):
+        # The cost setting changed since this hash was made; upgrade it quietly
+        rehash_later(password, lambda new_hash: db.users.update_one(
+            {"_id": user["_id"], "password_hash": user["password_hash"]},
+            {"$set": {"password_hash": new_hash}}))
+
+    token = create_access_token(identity=str(user["_id"]),
+                                additional_claims=identity_claims(user))
+    return jsonify({"token": token, "avatar_version": user.get("pfpVersion")}), 200
+
 
-    token = create_access_token(identity=str(user["_id"]))
-    return jsonify({"token": token}), 200
+@auth_bp.route("/logout", methods=["POST"])
+@jwt_required()
+def logout():
+    """Revokes the token used for this request for the rest of its lifetime."""
+    revoke(get_jwt())
+    return jsonify({"message": "Logged out"}), 200
 
 
 def role_required(role):
@@ -59,9 +145,7 @@ def role_required(role):
         @wraps(f)  # Preserve the original function name
         @jwt_required()
         def wrapper(*args, **kwargs):
-            user_id = get_jwt_identity()
-            user = db.users.find_one({"_id": ObjectId(user_id)})
-            if user["role"] != role:
+            if current_role() != role:
                 return jsonify({"error": "Unauthorized"}), 403
             return f(*args, **kwargs)
         return wrapper
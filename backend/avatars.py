@@ -0,0 +1,73 @@
+from flask import Blueprint, request, jsonify
+from bson import ObjectId
+from PIL import Image, ImageOps
+from io import BytesIO
+from database import db, fs
+from image_files import store_image, image_response, image_version
+import traceback
+import os
+
+avatars_bp = Blueprint("avatars", __name__)
+
+# Square sizes every profile picture is stored at
+avatar_sizes = [int(s) for s in os.getenv("AVATAR_SIZES", "48,96,256").split(",")]
+avatar_max_age = int(os.getenv("AVATAR_MAX_AGE", str(24 * 3600)))
+
+
+def encode_avatar(data):
+    """
+    Decodes an upload once, applies its EXIF orientation, crops it to a
+    centred square and yields (size, webp_bytes) for every avatar size.
+    """
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    for size in avatar_sizes:
+        square = ImageOps.fit(image, (size, size), method=Image.LANCZOS)
+        buffer = BytesIO()
+        square.save(buffer, format="WEBP", quality=85, method=6)
+        yield size, buffer.getvalue()
+
+
+def process_avatar(user_id, upload_id):
+    """
+    Turns a raw profile picture upload into WebP variants in GridFS, indexed
+    on the user as [{"size", "fileId", "etag"}]. The raw upload is dropped
+    either way; uploads that aren't images leave the user without a picture.
+    """
+    user_id = ObjectId(user_id)
+    variants = []
+    try:
+        for size, data in encode_avatar(fs.get(upload_id).read()):
+            file_id, etag = store_image(data, "image/webp", size=size)
+            variants.append({"size": size, "fileId": file_id, "etag": etag})
+        old = db.users.find_one_and_update({"_id": user_id}, {"$set": {
+            "pfp": None, "pfpVariants": variants, "pfpVersion": image_version(variants),
+            "pfpStatus": "ready"}})
+        for variant in (old or {}).get("pfpVariants") or []:
+            fs.delete(variant["fileId"])
+    except Exception:
+        traceback.print_exc()
+        for variant in variants:
+            fs.delete(variant["fileId"])
+        db.users.update_one({"_id": user_id}, {
+                            "$set": {"pfp": None, "pfpStatus": "failed"}})
+    finally:
+        fs.delete(upload_id)
+
+
+@avatars_bp.route("/<user_id>/avatar", methods=["GET"])
+def get_avatar(user_id):
+    """
+    Serves a profile picture at the smallest stored size covering the `size`
+    query parameter (the largest if none does). Public, and with `v` set to
+    the user's avatar version cacheable without revalidation, so rosters and
+    chats can load many at once.
+    """
+    user = db.users.find_one({"_id": ObjectId(user_id)}, {"pfpVariants": 1, "pfpVersion": 1})
+    variants = sorted((user or {}).get("pfpVariants") or [], key=lambda v: v["size"])
+    if not variants:
+        return jsonify({"error": "No profile picture"}), 404
+    size = request.args.get("size", type=int)
+    variant = next((v for v in variants if size and v["size"] >= size), variants[-1])
+    return image_response(variant["fileId"], variant["etag"], "image/webp", avatar_max_age,
+                          user.get("pfpVersion"))
@@ -0,0 +1,151 @@
+from pymongo.errors import DuplicateKeyError
+from database import db, fs
+from extensions import socketio, user_room
+from imgen import generate_banner, BANNER_PROMPT_VERSION
+from key_locks import key_lock
+from image_files import store_image, image_version
+from datetime import datetime
+from PIL import Image
+from io import BytesIO
+import traceback
+import os
+
+# Widths every banner is stored at; heights keep the 4:1 banner ratio
+banner_widths = [int(w) for w in os.getenv(
+    "BANNER_WIDTHS", "256,512,1024").split(",")]
+banner_formats = {"webp": "image/webp", "png": "image/png"}
+themes = ("light", "dark")
+
+# Banners shared by every class with the same subject, keyed by subject_key()
+cache = db.bannerCache
+
+
+def encode_banner(image):
+    """Yields (width, format, bytes) for every stored size and format of a banner."""
+    for width in banner_widths:
+        size = (width, width * image.height // image.width)
+        resized = image if size == image.size else image.resize(size, Image.LANCZOS)
+        for fmt in banner_formats:
+            buffer = BytesIO()
+            if fmt == "webp":
+                resized.save(buffer, format="WEBP", quality=85, method=6)
+            else:
+                resized.save(buffer, format="PNG", optimize=True)
+            yield width, fmt, buffer.getvalue()
+
+
+def store_banner(image):
+    """
+    Encodes a banner once into GridFS and returns its variants:
+    [{"width", "format", "fileId", "etag"}].
+    """
+    variants = []
+    for width, fmt, data in encode_banner(image):
+        file_id, etag = store_image(data, banner_formats[fmt], width=width)
+        variants.append({"width": width, "format": fmt,
+                         "fileId": file_id, "etag": etag})
+    return variants
+
+
+def delete_banner(variants):
+    for variant in variants or []:
+        fs.delete(variant["fileId"])
+
+
+def pick_variant(variants, width=None, accept_webp=True, fmt=None):
+    """
+    The stored variant to serve: the requested format (else WebP when the
+    client accepts it) at the smallest width covering `width`.
+    """
+    fmt = fmt or ("webp" if accept_webp else "png")
+    candidates = sorted((v for v in variants if v["format"] == fmt),
+                        key=lambda v: v["width"])
+    if not candidates:
+        return None
+    if width:
+        for variant in candidates:
+            if variant["width"] >= width:
+                return variant
+    return candidates[-1]
+
+
+def subject_key(subject):
+    """"Physics", " physics " and "PHYSICS" share a banner, per prompt version."""
+    return f"{BANNER_PROMPT_VERSION}:{' '.join(subject.casefold().split())}"
+
+
+def banner_version(banner):
+    """Version of a {"bannerLight", "bannerDark"} pair, for versioned banner URLs."""
+    return image_version(banner["bannerLight"] + banner["bannerDark"])
+
+
+def cached_banner(subject):
+    """The cached {"bannerLight", "bannerDark"} for a subject, or None."""
+    entry = cache.find_one_and_update(
+        {"_id": subject_key(subject)}, {"$inc": {"hits": 1}})
+    if not entry:
+        return None
+    return {"bannerLight": entry["light"], "bannerDark": entry["dark"]}
+
+
+def _generate_and_store(subject, dark_mode=None):
+    light_img, dark_img = generate_banner(subject, dark_mode)
+    if light_img is None or dark_img is None:
+        raise ValueError("No image in model response")
+    return {"bannerLight": store_banner(light_img),
+            "bannerDark": store_banner(dark_img)}
+
+
+def _subject_banner(subject):
+    key = subject_key(subject)
+    with key_lock(f"banner:{key}"):
+        banner = cached_banner(subject)
+        if banner is None:
+            banner = _generate_and_store(subject)
+            try:
+                cache.insert_one({"_id": key, "subject": subject,
+                                  "light": banner["bannerLight"],
+                                  "dark": banner["bannerDark"],
+                                  "hits": 0, "created_at": datetime.utcnow()})
+            except DuplicateKeyError:
+                # Another worker process cached this subject first
+                delete_banner(banner["bannerLight"] + banner["bannerDark"])
+                banner = cached_banner(subject)
+    return banner
+
+
+def render_class_banners(class_id, subject, regenerate=False, dark_mode=None,
+                         owner_id=None):
+    """
+    Gives a class its light and dark banners and announces the result on the
+    class's Socket.IO room and, if given, the room of `owner_id` (who may not
+    have joined the class room yet). The subject's cached banners are reused
+    unless `regenerate` asks for a new banner unique to this class, optionally
+    with its own dark mode ("model" or "local", see imgen.generate_banner).
+    """
+    room = str(class_id)
+    rooms = [room, user_room(owner_id)] if owner_id else room
+    try:
+        if regenerate:
+            banner = _generate_and_store(subject, dark_mode)
+        else:
+            banner = _subject_banner(subject)
+        old = db.classes.find_one_and_update({"_id": class_id}, {"$set": {
+            **banner,
+            "bannerVersion": banner_version(banner),
+            "bannerShared": not regenerate,
+            "bannerStatus": "ready"
+        }})
+        # Banners owned by the class alone are replaced; shared ones stay cached
+        if old and not old.get("bannerShared", True):
+            for theme in ("bannerLight", "bannerDark"):
+                if isinstance(old.get(theme), list):
+                    delete_banner(old[theme])
+    except Exception as e:
+        traceback.print_exc()
+        db.classes.update_one({"_id": class_id}, {
+                              "$set": {"bannerStatus": "failed"}})
+        socketio.emit("class_banner_failed", {
+            "class_id": room, "error": str(e)}, room=rooms)
+        return
+    socketio.emit("class_banner_ready", {"class_id": room}, room=rooms)
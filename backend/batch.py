@@ -0,0 +1,156 @@
+from google.genai import types
+from question_generator import MODEL
+import gemini_client
+import tempfile
+import base64
+import shutil
+import json
+import uuid
+import os
+
+# Which backend offline generation jobs go to: "gemini" or "local"
+default_backend = os.getenv("QUIZ_BATCH_BACKEND", "gemini")
+# Where the local stand-in keeps its input and output files
+local_batch_dir = os.getenv("QUIZ_BATCH_DIR", os.path.join(
+    tempfile.gettempdir(), "quiz_batches"))
+
+
+def _part_to_json(part):
+    if isinstance(part, str):
+        return {"text": part}
+    return {"inline_data": {
+        "mime_type": part.inline_data.mime_type,
+        "data": base64.b64encode(part.inline_data.data).decode("ascii")
+    }}
+
+
+def write_batch_file(path, requests, generation_config=None):
+    """
+    Writes one JSONL line per (key, parts) pair in the batch request format:
+    {"key": ..., "request": {"contents": [{"role": "user", "parts": [...]}]}}
+    `generation_config` (REST field names) is attached to every request.
+    """
+    with open(path, "w") as f:
+        for key, parts in requests:
+            line = {"key": key, "request": {"contents": [
+                {"role": "user", "parts": [_part_to_json(p) for p in parts]}]}}
+            if generation_config:
+                line["request"]["generationConfig"] = generation_config
+            f.write(json.dumps(line) + "\n")
+
+
+def read_batch_results(lines):
+    """Yields (key, text, error) for every line of a batch result file."""
+    for line in lines:
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        if result.get("error"):
+            yield result["key"], None, str(result["error"])
+            continue
+        try:
+            parts = result["response"]["candidates"][0]["content"]["parts"]
+            yield result["key"], "".join(p.get("text", "") for p in parts), None
+        except (KeyError, IndexError) as e:
+            yield result["key"], None, f"Malformed result: {e}"
+
+
+def _generate_response(request):
+    """Default local responder: answers one batch request synchronously."""
+    config = request.get("generationConfig")
+    response = gemini_client.generate_content(
+        model=MODEL, contents=request["contents"],
+        config=types.GenerateContentConfig.model_validate(config) if config else None)
+    return {"candidates": [{"content": {"parts": [{"text": response.text}]}}]}
+
+
+class LocalFileBatchBackend:
+    """
+    File-based stand-in for a batch service. submit() copies the input into
+    `directory`; run_pending() answers every request with `responder` and
+    writes the result file, after which the batch reports "succeeded".
+    """
+    name = "local"
+
+    def __init__(self, directory=None, responder=None):
+        self.directory = directory or local_batch_dir
+        self.responder = responder or _generate_response
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, batch_id, suffix):
+        return os.path.join(self.directory, f"{batch_id}.{suffix}.jsonl")
+
+    def submit(self, input_path):
+        batch_id = uuid.uuid4().hex
+        shutil.copyfile(input_path, self._path(batch_id, "input"))
+        return batch_id
+
+    def status(self, batch_id):
+        if os.path.exists(self._path(batch_id, "output")):
+            return "succeeded"
+        if not os.path.exists(self._path(batch_id, "input")):
+            return "failed"
+        return "pending"
+
+    def fetch_results(self, batch_id):
+        """Yields the lines of a finished batch's result file."""
+        with open(self._path(batch_id, "output")) as f:
+            yield from f
+
+    def run_pending(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith(".input.jsonl"):
+                continue
+            batch_id = name.split(".")[0]
+            if self.status(batch_id) != "pending":
+                continue
+            output = self._path(batch_id, "output")
+            # Per-process temp file: several workers may run the same batch
+            tmp = f"{output}.{os.getpid()}.tmp"
+            with open(self._path(batch_id, "input")) as src, open(tmp, "w") as dst:
+                for line in src:
+                    request = json.loads(line)
+                    try:
+                        result = {"key": request["key"],
+                                  "response": self.responder(request["request"])}
+                    except Exception as e:
+                        result = {"key": request["key"], "error": str(e)}
+                    dst.write(json.dumps(result) + "\n")
+            os.replace(tmp, output)
+
+
+class GeminiBatchBackend:
+    """Gemini Batch API: the input file is uploaded and processed offline."""
+    name = "gemini"
+
+    states = {
+        "JOB_STATE_SUCCEEDED": "succeeded",
+        "JOB_STATE_FAILED": "failed",
+        "JOB_STATE_CANCELLED": "failed",
+        "JOB_STATE_EXPIRED": "failed",
+    }
+
+    def submit(self, input_path):
+        uploaded = gemini_client.client.files.upload(
+            file=input_path, config=types.UploadFileConfig(mime_type="jsonl"))
+        job = gemini_client.client.batches.create(model=MODEL, src=uploaded.name)
+        return job.name
+
+    def status(self, batch_id):
+        job = gemini_client.client.batches.get(name=batch_id)
+        return self.states.get(job.state.name, "pending")
+
+    def fetch_results(self, batch_id):
+        job = gemini_client.client.batches.get(name=batch_id)
+        content = gemini_client.client.files.download(file=job.dest.file_name)
+        # Read straight from memory: nothing is left on disk if ingesting fails
+        return content.decode("utf-8").splitlines()
+
+
+def get_backend(name=None):
+    name = name or default_backend
+    if name == "local":
+        return LocalFileBatchBackend()
+    if name == "gemini":
+        return GeminiBatchBackend()
+    raise ValueError(f"Unknown batch backend: {name}")
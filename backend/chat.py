@@ -1,11 +1,13 @@
 from flask import Blueprint, request, jsonify
 from flask_socketio import emit, join_room, leave_room
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_jwt_identity, decode_token
 from bson import ObjectId
 from datetime import datetime
 from database import db  # Import db from database.py
 from auth import role_required  # Import role_required from auth.py
-from extensions import socketio  # Import socketio from extensions.py
+from extensions import socketio, user_room  # Import socketio from extensions.py
+from membership import class_role
+from revocation import is_revoked
 
 chat_bp = Blueprint("chat", __name__)
 
@@ -18,8 +20,7 @@ def post_message():
     class_id = ObjectId(data["classId"])
     message = data["message"]
 
-    if not (db.classes.find_one({"_id": class_id, "teacherId": ObjectId(user_id)}) or
-            db.classMembers.find_one({"classId": class_id, "studentId": ObjectId(user_id)})):
+    if not class_role(user_id, class_id):
         return jsonify({"error": "Unauthorized"}), 403
 
     chat_message = {
@@ -39,8 +40,7 @@ def get_messages(class_id):
     user_id = get_jwt_identity()
     class_id = ObjectId(class_id)
 
-    if not (db.classes.find_one({"_id": class_id, "teacherId": ObjectId(user_id)}) or
-            db.classMembers.find_one({"classId": class_id, "studentId": ObjectId(user_id)})):
+    if not class_role(user_id, class_id):
         return jsonify({"error": "Unauthorized"}), 403
 
     messages = db.chatMessages.find({"classId": class_id}).sort("timestamp", 1)
@@ -53,6 +53,17 @@ def on_join(data):
     join_room(class_id)
 
 
+@socketio.on("join_user")
+def on_join_user(data):
+    """Joins the room of the user whose access token is sent as "token"."""
+    try:
+        claims = decode_token(data["token"])
+    except Exception:
+        return
+    if not is_revoked(claims):
+        join_room(user_room(claims["sub"]))
+
+
 @socketio.on("leave")
 def on_leave(data):
     class_id = data["classId"]
@@ -0,0 +1,78 @@
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from datetime import datetime
+from database import db
+from jobs import executor
+import threading
+import random
+import string
+import os
+
+# Codes kept in reserve; 0 disables the pool and codes are drawn at random
+pool_size = int(os.getenv("CLASS_CODE_POOL_SIZE", "0"))
+# Refill the pool in the background once it drops below this many codes
+pool_low_water = int(os.getenv("CLASS_CODE_POOL_LOW_WATER", str(pool_size // 4)))
+max_attempts = 10
+
+db.classes.create_index("code", unique=True)
+pool = db.classCodePool
+
+_refill_lock = threading.Lock()
+
+
+def random_code():
+    """A code in the xxx-xxx-xxx format shown to students."""
+    return "-".join(["".join(random.choices(string.ascii_lowercase, k=3))
+                     for _ in range(3)])
+
+
+def refill_pool():
+    """Tops the pool up to `pool_size` codes not used by any class."""
+    if not _refill_lock.acquire(blocking=False):
+        return  # another refill is already running
+    try:
+        missing = pool_size - pool.estimated_document_count()
+        if missing <= 0:
+            return
+        codes = {random_code() for _ in range(missing)}
+        codes -= {c["code"] for c in db.classes.find(
+            {"code": {"$in": list(codes)}}, {"code": 1})}
+        if not codes:
+            return
+        try:
+            pool.insert_many([{"_id": code, "created_at": datetime.utcnow()}
+                              for code in codes], ordered=False)
+        except BulkWriteError:
+            pass  # some codes were already in the pool
+    finally:
+        _refill_lock.release()
+
+
+def _take_code():
+    if pool_size:
+        reserved = pool.find_one_and_delete({})
+        if pool.estimated_document_count() < pool_low_water:
+            executor.submit(refill_pool)
+        if reserved:
+            return reserved["_id"]
+    return random_code()
+
+
+def insert_with_code(document):
+    """
+    Inserts a class with a fresh code and returns (class_id, code). The unique
+    index on classes.code settles collisions: a taken code raises
+    DuplicateKeyError and another one is tried, so no lookup is needed first
+    and concurrent creations can't end up sharing a code.
+    """
+    for _ in range(max_attempts):
+        code = _take_code()
+        try:
+            return db.classes.insert_one({**document, "code": code}).inserted_id, code
+        except DuplicateKeyError as e:
+            if "code" not in (e.details or {}).get("keyPattern", {}):
+                raise
+    raise RuntimeError("Could not allocate a unique class code")
+
+
+if pool_size:
+    executor.submit(refill_pool)
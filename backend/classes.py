@@ -1,40 +1,146 @@
 from flask import Blueprint, request, jsonify
 from bson import ObjectId
 from datetime import datetime
-import random
-import string
 from database import db  # Import db from database.py
 from auth import role_required  # Import role_required from auth.py
 from flask_jwt_extended import get_jwt_identity  # Import get_jwt_identity
-from imgen import generate_banner
+from class_codes import insert_with_code
+from banners import render_class_banners, cached_banner, pick_variant, banner_formats, themes
+from banners import banner_version
+from jobs import executor
+from membership import invalidate_membership
+from image_files import image_response
+import os
 
 classes_bp = Blueprint("classes", __name__)
 
+# How long browsers and proxies may reuse a versioned banner URL before revalidating it
+banner_max_age = int(os.getenv("BANNER_MAX_AGE", str(7 * 24 * 3600)))
+default_page_size = 50
+max_page_size = 200
+# Fields class listings return
+listed_fields = ["subject", "code", "bannerStatus", "bannerVersion"]
+
+db.classMembers.create_index([("studentId", 1), ("classId", 1)])
+db.classes.create_index([("teacherId", 1), ("_id", 1)])
+
+
+def list_classes(match, after=None, limit=default_page_size, via_members=False):
+    """
+    One page of classes, ordered by id, in a single round trip. With
+    `via_members` the match runs against classMembers and the classes are
+    joined in with $lookup; otherwise it runs against classes directly.
+    Returns (classes, next_cursor); pass next_cursor back as `after`.
+    """
+    key = "classId" if via_members else "_id"
+    if after:
+        match = {**match, key: {"$gt": after}}
+    pipeline = [{"$match": match}, {"$sort": {key: 1}}, {"$limit": limit + 1}]
+    if via_members:
+        pipeline += [
+            {"$lookup": {"from": "classes", "localField": "classId",
+                         "foreignField": "_id", "as": "class"}},
+            {"$project": {"_id": "$classId", **{
+                field: {"$arrayElemAt": [f"$class.{field}", 0]}
+                for field in listed_fields}}}
+        ]
+    else:
+        pipeline.append({"$project": {field: 1 for field in listed_fields}})
+    docs = list((db.classMembers if via_members else db.classes).aggregate(pipeline))
+
+    next_cursor = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+    classes = [{"class_id": str(doc["_id"]), **{field: doc.get(field) for field in listed_fields}}
+               for doc in docs[:limit] if doc.get("subject") is not None]
+    return classes, next_cursor
+
+
+def _page_args():
+    after = request.args.get("after")
+    limit = request.args.get("limit", default_page_size, type=int)
+    return (ObjectId(after) if after else None), max(1, min(limit, max_page_size))
+
 
 @classes_bp.route("/", methods=["POST"], endpoint="create_class")
 @role_required("teacher")
 def create_class():
     user_id = get_jwt_identity()
     subject = request.json["subject"]
+    # Teachers who want a banner of their own skip the subject's shared one
+    regenerate = bool(request.json.get("regenerate_banner"))
 
-    while True:
-        code = "-".join(["".join(random.choices(string.ascii_lowercase, k=3))
-                        for _ in range(3)])
-        if not db.classes.find_one({"code": code}):
-            break
-
-    # generate the banner image using the subject
-    light_img, dark_img = generate_banner(subject)
     class_data = {
         "subject": subject,
-        "code": code,
         "teacherId": ObjectId(user_id),
         "created_at": datetime.utcnow(),
-        "bannerLight": light_img,
-        "bannerDark": dark_img
     }
-    class_id = db.classes.insert_one(class_data).inserted_id
-    return jsonify({"class_id": str(class_id), "code": code}), 201
+    banner = None if regenerate else cached_banner(subject)
+    if banner:
+        class_data.update(banner, bannerVersion=banner_version(banner),
+                          bannerShared=True, bannerStatus="ready")
+    else:
+        # Banners are generated in the background; until then they are placeholders
+        class_data.update(bannerLight=None, bannerDark=None, bannerVersion=None,
+                          bannerStatus="pending")
+    class_id, code = insert_with_code(class_data)
+    if not banner:
+        executor.submit(render_class_banners, class_id, subject, regenerate,
+                        owner_id=user_id)
+    return jsonify({"class_id": str(class_id), "code": code,
+                    "banner_status": class_data["bannerStatus"],
+                    "banner_version": class_data["bannerVersion"]}), 201
+
+
+@classes_bp.route("/<class_id>/banner/regenerate", methods=["POST"])
+@role_required("teacher")
+def regenerate_class_banner(class_id):
+    """
+    Replaces a class's banner with a newly generated one unique to it.
+    "dark_mode" ("model" or "local") picks how the dark variant is made.
+    """
+    user_id = get_jwt_identity()
+    dark_mode = (request.get_json(silent=True) or {}).get("dark_mode")
+    if dark_mode not in (None, "model", "local"):
+        return jsonify({"error": "Invalid dark_mode"}), 400
+    class_doc = db.classes.find_one_and_update(
+        {"_id": ObjectId(class_id), "teacherId": ObjectId(user_id)},
+        {"$set": {"bannerStatus": "pending"}})
+    if not class_doc:
+        return jsonify({"error": "Class not found"}), 404
+    executor.submit(render_class_banners, class_doc["_id"],
+                    class_doc["subject"], True, dark_mode, owner_id=user_id)
+    return jsonify({"banner_status": "pending"}), 202
+
+
+@classes_bp.route("/<class_id>/banner", methods=["GET"])
+def get_class_banner(class_id):
+    """
+    Serves a class banner. Query parameters: theme (light or dark), width and
+    format (webp or png, by default WebP if the client accepts it), and v,
+    the class's bannerVersion, which makes the response cacheable for
+    banner_max_age. Without it caches revalidate every time.
+    """
+    theme = request.args.get("theme", "light")
+    fmt = request.args.get("format")
+    if theme not in themes or (fmt and fmt not in banner_formats):
+        return jsonify({"error": "Invalid theme or format"}), 400
+
+    field = "bannerLight" if theme == "light" else "bannerDark"
+    class_doc = db.classes.find_one({"_id": ObjectId(class_id)},
+                                    {field: 1, "bannerVersion": 1})
+    if not class_doc:
+        return jsonify({"error": "Class not found"}), 404
+    variants = class_doc.get(field)
+    variant = pick_variant(variants, request.args.get("width", type=int),
+                           "image/webp" in request.headers.get("Accept", ""),
+                           fmt) if isinstance(variants, list) else None
+    if not variant:
+        return jsonify({"error": "Banner not ready"}), 404
+
+    response = image_response(variant["fileId"], variant["etag"],
+                              banner_formats[variant["format"]], banner_max_age,
+                              class_doc.get("bannerVersion"))
+    response.vary.add("Accept")
+    return response
 
 
 @classes_bp.route("/join", methods=["POST"], endpoint="join_class")
@@ -52,6 +158,7 @@ def join_class():
         return jsonify({"error": "Already enrolled"}), 400
 
     db.classMembers.insert_one(membership)
+    invalidate_membership(user_id, class_doc["_id"])
     return jsonify({"message": "Joined class"}), 200
 
 
@@ -59,29 +166,17 @@ def join_class():
 @role_required("student")
 def get_student_classes():
     user_id = get_jwt_identity()
-    memberships = db.classMembers.find({"studentId": ObjectId(user_id)})
-    classes = []
-    for membership in memberships:
-        class_doc = db.classes.find_one({"_id": membership["classId"]})
-        if class_doc:
-            classes.append({
-                "class_id": str(class_doc["_id"]),
-                "subject": class_doc["subject"],
-                "code": class_doc["code"]
-            })
-    return jsonify({"classes": classes}), 200
+    after, limit = _page_args()
+    classes, next_cursor = list_classes(
+        {"studentId": ObjectId(user_id)}, after, limit, via_members=True)
+    return jsonify({"classes": classes, "next_cursor": next_cursor}), 200
 
 
 @classes_bp.route("/teacher", methods=["GET"])
 @role_required("teacher")
 def get_teacher_classes():
     user_id = get_jwt_identity()
-    classes = db.classes.find({"teacherId": ObjectId(user_id)})
-    class_list = []
-    for class_doc in classes:
-        class_list.append({
-            "class_id": str(class_doc["_id"]),
-            "subject": class_doc["subject"],
-            "code": class_doc["code"]
-        })
-    return jsonify({"classes": class_list}), 200
+    after, limit = _page_args()
+    classes, next_cursor = list_classes(
+        {"teacherId": ObjectId(user_id)}, after, limit)
+    return jsonify({"classes": classes, "next_cursor": next_cursor}), 200
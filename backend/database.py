@@ -1,4 +1,5 @@
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
 from gridfs import GridFS
 from dotenv import load_dotenv
 import os
@@ -9,3 +10,17 @@ client = MongoClient(
     os.getenv("MONGO_URI", "mongodb://localhost:27017/"))
 db = client["classroom_db"]
 fs = GridFS(db)
+
+
+def run_in_transaction(callback):
+    """
+    Runs callback(session) inside a transaction. Standalone servers don't
+    support transactions, so there it runs as callback(None) instead.
+    """
+    try:
+        with client.start_session() as session:
+            return session.with_transaction(callback)
+    except OperationFailure as e:
+        if e.code != 20:  # IllegalOperation: not a replica set
+            raise
+    return callback(None)
@@ -1,3 +1,8 @@
 from flask_socketio import SocketIO
 
 socketio = SocketIO()
+
+
+def user_room(user_id):
+    """Socket.IO room for events meant for one user, joined with "join_user"."""
+    return f"user:{user_id}"
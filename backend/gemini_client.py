@@ -0,0 +1,252 @@
+from google import genai
+from google.genai import errors, types
+import threading
+import random
+import httpx
+import time
+import os
+
+# Seconds before a request is abandoned and retried, so a hung call can't
+# hold one of its model's concurrency slots forever
+request_timeout = float(os.getenv("GEMINI_REQUEST_TIMEOUT", "60"))
+
+# Shared by every module that talks to Gemini
+client = genai.Client(http_options=types.HttpOptions(timeout=int(request_timeout * 1000)))
+
+# Defaults for any model without its own entry in `model_limits`
+default_rpm = int(os.getenv("GEMINI_RPM", "60"))
+default_tpm = int(os.getenv("GEMINI_TPM", "1000000"))
+default_concurrency = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+max_retries = int(os.getenv("GEMINI_MAX_RETRIES", "5"))
+backoff_base = float(os.getenv("GEMINI_BACKOFF_BASE", "1"))
+backoff_cap = float(os.getenv("GEMINI_BACKOFF_CAP", "60"))
+# Seconds between metrics log lines (0 = off)
+metrics_interval = float(os.getenv("GEMINI_METRICS_INTERVAL", "300"))
+
+# Output tokens assumed for a call before the real usage is known
+expected_output_tokens = 1000
+retryable_codes = {408, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Refills continuously at `per_minute` units per minute, up to that many."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount):
+        """Blocks until `amount` units are available; returns seconds waited."""
+        amount = min(amount, self.capacity)
+        waited = 0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount):
+        """Charges (or refunds, if negative) units after the fact."""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class ModelLimiter:
+    def __init__(self, rpm, tpm, concurrency):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "queued": 0,
+                      "in_flight": 0, "max_queued": 0, "throttled_seconds": 0.0}
+
+    def _bump(self, **deltas):
+        with self.lock:
+            for key, delta in deltas.items():
+                self.stats[key] += delta
+            self.stats["max_queued"] = max(self.stats["max_queued"], self.stats["queued"])
+
+
+model_limits = {}
+_limits_lock = threading.Lock()
+_metrics_logger = None
+
+
+def configure_model(model, rpm=None, tpm=None, concurrency=None):
+    """Sets the request/token per minute quota and concurrency cap for a model."""
+    with _limits_lock:
+        model_limits[model] = ModelLimiter(rpm or default_rpm, tpm or default_tpm,
+                                           concurrency or default_concurrency)
+
+
+def configure_model_from_env(model, prefix):
+    """
+    Limits for a model from <prefix>_RPM, <prefix>_TPM and
+    <prefix>_MAX_CONCURRENCY, each falling back to its GEMINI_* default.
+    """
+    configure_model(model, rpm=int(os.getenv(f"{prefix}_RPM", "0")),
+                    tpm=int(os.getenv(f"{prefix}_TPM", "0")),
+                    concurrency=int(os.getenv(f"{prefix}_MAX_CONCURRENCY", "0")))
+
+
+def _limiter(model):
+    with _limits_lock:
+        if model not in model_limits:
+            model_limits[model] = ModelLimiter(
+                default_rpm, default_tpm, default_concurrency)
+        return model_limits[model]
+
+
+def estimate_tokens(contents):
+    """Rough input token count: ~4 characters per token, 258 per image or PDF page."""
+    total = 0
+    for part in contents if isinstance(contents, list) else [contents]:
+        if isinstance(part, str):
+            total += len(part) // 4
+            continue
+        data = getattr(part, "inline_data", None)
+        if data is not None:
+            if data.mime_type == "application/pdf":
+                total += 258 * max(1, data.data.count(b"/Type /Page") -
+                                   data.data.count(b"/Type /Pages"))
+            else:
+                total += 258
+        elif getattr(part, "text", None):
+            total += len(part.text) // 4
+    return total + expected_output_tokens
+
+
+def _retryable(error):
+    if isinstance(error, errors.APIError):
+        return error.code in retryable_codes
+    # httpx.TimeoutException covers requests cut off by request_timeout
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError,
+                              ConnectionError, TimeoutError))
+
+
+def _backoff(attempt):
+    # Full jitter keeps a burst of failed callers from retrying in lockstep
+    return random.uniform(0, min(backoff_cap, backoff_base * 2 ** attempt))
+
+
+def _acquire(limiter, estimated):
+    limiter._bump(queued=1)
+    try:
+        waited = limiter.requests.acquire(1)
+        waited += limiter.tokens.acquire(estimated)
+        limiter.slots.acquire()
+    finally:
+        limiter._bump(queued=-1)
+    limiter._bump(in_flight=1, calls=1, throttled_seconds=waited)
+
+
+def _release(limiter):
+    limiter._bump(in_flight=-1)
+    limiter.slots.release()
+
+
+def _give_up(limiter, error, attempt):
+    if attempt >= max_retries or not _retryable(error):
+        limiter._bump(failures=1)
+        return True
+    limiter._bump(retries=1)
+    return False
+
+
+def _charge_usage(limiter, estimated, response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None and usage.total_token_count:
+        limiter.tokens.adjust(usage.total_token_count - estimated)
+
+
+def generate_content(model, contents, config=None):
+    """
+    client.models.generate_content behind the model's rate limits and
+    concurrency cap, retrying quota and server errors with exponential backoff.
+    """
+    limiter = _limiter(model)
+    estimated = estimate_tokens(contents)
+    attempt = 0
+    while True:
+        _acquire(limiter, estimated)
+        try:
+            response = client.models.generate_content(
+                model=model, contents=contents, config=config)
+            _charge_usage(limiter, estimated, response)
+            return response
+        except Exception as e:
+            if _give_up(limiter, e, attempt):
+                raise
+        finally:
+            _release(limiter)
+        time.sleep(_backoff(attempt))
+        attempt += 1
+
+
+def generate_content_stream(model, contents, config=None):
+    """
+    Streaming counterpart of generate_content. The call is retried only while
+    no chunk has been received; a stream that breaks later raises as is.
+    """
+    limiter = _limiter(model)
+    estimated = estimate_tokens(contents)
+    attempt = 0
+    while True:
+        _acquire(limiter, estimated)
+        last = None
+        try:
+            for chunk in client.models.generate_content_stream(
+                    model=model, contents=contents, config=config):
+                last = chunk
+                yield chunk
+            if last is not None:
+                _charge_usage(limiter, estimated, last)
+            return
+        except Exception as e:
+            if last is not None:
+                limiter._bump(failures=1)
+                raise
+            if _give_up(limiter, e, attempt):
+                raise
+        finally:
+            _release(limiter)
+        time.sleep(_backoff(attempt))
+        attempt += 1
+
+
+def metrics():
+    """Per-model counters: calls, retries, failures, queue depth, throttled time."""
+    with _limits_lock:
+        limiters = dict(model_limits)
+    return {model: dict(limiter.stats) for model, limiter in limiters.items()}
+
+
+def _log_metrics_forever():
+    while True:
+        time.sleep(metrics_interval)
+        for model, stats in metrics().items():
+            print(f"gemini {model}: " + " ".join(
+                f"{key}={value:.1f}" if isinstance(value, float) else f"{key}={value}"
+                for key, value in stats.items()))
+
+
+def start_metrics_logger():
+    """Starts the background thread that prints metrics() every metrics_interval seconds."""
+    global _metrics_logger
+    if metrics_interval > 0 and _metrics_logger is None:
+        _metrics_logger = threading.Thread(
+            target=_log_metrics_forever, name="gemini-metrics", daemon=True)
+        _metrics_logger.start()
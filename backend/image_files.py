@@ -0,0 +1,41 @@
+from flask import Response, request
+from database import fs
+import hashlib
+
+
+def store_image(data, content_type, **metadata):
+    """
+    Puts an encoded image into GridFS; returns (file_id, etag). The ETag is
+    the content hash, so it can be checked without reading the file back.
+    """
+    etag = hashlib.sha256(data).hexdigest()
+    file_id = fs.put(data, content_type=content_type,
+                     metadata={"etag": etag, **metadata})
+    return file_id, etag
+
+
+def image_version(variants):
+    """Short token that changes whenever any stored variant of an image does."""
+    return hashlib.sha256("".join(v["etag"] for v in variants).encode()).hexdigest()[:16]
+
+
+def image_response(file_id, etag, mimetype, max_age, version=None):
+    """
+    Serves a stored image as a public response with a strong ETag. A matching
+    If-None-Match gets a 304 without touching GridFS. Only a URL whose `v`
+    query parameter is the image's current `version` may be reused for
+    `max_age` seconds without revalidating, as that URL changes along with the
+    image; any other URL is revalidated on every use.
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(fs.get(file_id).read(), mimetype=mimetype)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    if version and request.args.get("v") == version:
+        response.cache_control.max_age = max_age
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
@@ -1,11 +1,14 @@
-from google import genai
 from google.genai import types
 from PIL import Image
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+import threading
 import base64
-from PIL import Image, ImageOps
+import os
+from PIL import Image, ImageOps, ImageEnhance
 
-client = genai.Client()
+import gemini_client
 # Change this to the desired subject
 
 
@@ -17,9 +20,22 @@ client = genai.Client()
 # HAND-DRAWN DOODLE BANNER
 
 
-def generate_banner(subject):
-    light_img = None
-    Dark_img = None
+# Bump whenever the banner prompts change so cached banners are not reused
+BANNER_PROMPT_VERSION = 1
+IMAGE_MODEL = "gemini-2.0-flash-exp-image-generation"
+gemini_client.configure_model_from_env(IMAGE_MODEL, "GEMINI_IMAGE")
+BANNER_SIZE = (1024, 256)
+
+# "model" asks the image model for the dark banner, "local" derives it from the light one
+dark_mode_default = os.getenv("BANNER_DARK_MODE", "model")
+transform_workers = int(os.getenv("BANNER_TRANSFORM_WORKERS", "2"))
+
+_transform_pool = None
+_transform_pool_lock = threading.Lock()
+
+
+def banner_prompts(subject):
+    """The (light, dark) banner prompts for a subject."""
     light = (f"""Generate a 1000x250 pixel banner for {subject}, featuring a cartoony, hand-drawn doodle style. Use a muted, pastel-based color palette for a soft, inviting look. Avoid overly bright or saturated colors to maintain a soothing and visually pleasing design.
 
  The background should include scattered, hand-drawn doodles related to {subject}, evenly distributed across the banner. These doodles should have a sketch-like, freehand style—simple outlines with slight variations to give a natural, artistic feel. Maintain a clean and uncluttered composition with balanced negative space.
@@ -36,49 +52,72 @@ Use light, pastel, or neon-like doodles and accents to contrast against the dark
 Prominently display the subject name "{subject}" in a complementary light color that stands out against the dark background. The font should be playful, slightly rounded, or hand-drawn to match the doodle style.
 
 The final design should be visually balanced, with negative space to avoid clutter, and must not include any logos.""")
+    return light, dark
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash-exp-image-generation",
-        contents=light,
-        config=types.GenerateContentConfig(
-            response_modalities=['Text', 'Image']
-        )
-    )
 
-    for part in response.candidates[0].content.parts:
-        if part.text is not None:
-            print(part.text)
-        elif part.inline_data is not None:
-            image = Image.open(BytesIO((part.inline_data.data)))
-
-            target_size = (1024, 256)
-            resized_image = ImageOps.fit(
-                image, target_size, method=Image.LANCZOS)
-
-        # LIGHT IMAGE GENERATION
-            light_img = resized_image
-
-    response = client.models.generate_content(
-        model="gemini-2.0-flash-exp-image-generation",
-        contents=dark,
+def generate_image(prompt):
+    """One image-model call; returns the image fitted to BANNER_SIZE, or None."""
+    response = gemini_client.generate_content(
+        model=IMAGE_MODEL,
+        contents=prompt,
         config=types.GenerateContentConfig(
             response_modalities=['Text', 'Image']
         )
     )
 
+    resized_image = None
     for part in response.candidates[0].content.parts:
         if part.text is not None:
             print(part.text)
         elif part.inline_data is not None:
             image = Image.open(BytesIO((part.inline_data.data)))
-
-            target_size = (1024, 256)
             resized_image = ImageOps.fit(
-                image, target_size, method=Image.LANCZOS)
-            subject = subject.replace(" ", "-")
-
-            Dark_img = resized_image
-    return (light_img, Dark_img)
+                image, BANNER_SIZE, method=Image.LANCZOS)
+    return resized_image
+
+
+def derive_dark_banner(image):
+    """
+    Deterministic dark variant of a light banner: lightness is inverted while
+    hues are kept (invert, then rotate the hue half way round), and the result
+    is toned down a little. Keeps the BANNER_SIZE fit.
+    """
+    inverted = ImageOps.invert(image.convert("RGB"))
+    h, s, v = inverted.convert("HSV").split()
+    h = h.point(lambda x: (x + 128) % 256)
+    dark = Image.merge("HSV", (h, s, v)).convert("RGB")
+    dark = ImageEnhance.Brightness(dark).enhance(0.85)
+    dark = ImageEnhance.Contrast(dark).enhance(0.9)
+    return ImageOps.fit(dark, BANNER_SIZE, method=Image.LANCZOS)
+
+
+def _transforms():
+    # Pixel work is CPU bound, so it runs in worker processes rather than threads
+    global _transform_pool
+    with _transform_pool_lock:
+        if _transform_pool is None:
+            # Forking the threaded server can deadlock the children; start them fresh
+            _transform_pool = ProcessPoolExecutor(
+                max_workers=transform_workers, mp_context=multiprocessing.get_context("spawn"))
+        return _transform_pool
+
+
+def generate_banner(subject, dark_mode=None):
+    """
+    Generates the light and dark banners; returns (light, dark). In "model"
+    mode both come from the image model, concurrently; in "local" mode only
+    the light one does and the dark one is derived from it.
+    """
+    light, dark = banner_prompts(subject)
+    if (dark_mode or dark_mode_default) == "local":
+        light_img = generate_image(light)
+        if light_img is None:
+            return (None, None)
+        return (light_img, _transforms().submit(derive_dark_banner, light_img).result())
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        light_img = pool.submit(generate_image, light)
+        dark_img = pool.submit(generate_image, dark)
+        return (light_img.result(), dark_img.result())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,67 @@
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from datetime import datetime
+from database import db
+import traceback
+import os
+
+# Background workers shared by every long-running task (quiz generation, ...)
+executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("JOB_WORKERS", "4")), thread_name_prefix="job")
+
+
+def create_job(kind, owner_id, **fields):
+    """Records a queued job and returns its id."""
+    job = {
+        "kind": kind,
+        "ownerId": ObjectId(owner_id),
+        "status": "queued",
+        "progress": {"completed": 0, "total": 0},
+        "result": None,
+        "error": None,
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+        **fields
+    }
+    return db.jobs.insert_one(job).inserted_id
+
+
+def update_job(job_id, **fields):
+    fields["updated_at"] = datetime.utcnow()
+    db.jobs.update_one({"_id": ObjectId(job_id)}, {"$set": fields})
+
+
+def get_job(job_id):
+    return db.jobs.find_one({"_id": ObjectId(job_id)})
+
+
+def _run(job_id, fn, args, kwargs):
+    update_job(job_id, status="running")
+    try:
+        result = fn(job_id, *args, **kwargs)
+    except Exception as e:
+        traceback.print_exc()
+        update_job(job_id, status="failed", error=str(e))
+        return
+    update_job(job_id, status="completed", result=result)
+
+
+def submit_job(job_id, fn, *args, **kwargs):
+    """
+    Runs fn(job_id, *args, **kwargs) on the background pool. The job is marked
+    running, then completed with fn's return value or failed with its error.
+    """
+    return executor.submit(_run, job_id, fn, args, kwargs)
+
+
+def serialize_job(job):
+    return {
+        "job_id": str(job["_id"]),
+        "kind": job["kind"],
+        "status": job["status"],
+        "progress": job["progress"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"].isoformat(),
+        "updated_at": job["updated_at"].isoformat()
+    }
@@ -0,0 +1,26 @@
+from contextlib import contextmanager
+import threading
+
+# key -> [lock, number of threads holding or waiting on it]
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+@contextmanager
+def key_lock(key):
+    """
+    In-process lock per key, so concurrent misses for the same key produce
+    one expensive computation instead of several. A key's lock is dropped
+    once nobody holds or waits on it, so the registry stays small.
+    """
+    with _locks_guard:
+        entry = _locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _locks[key]
@@ -0,0 +1,44 @@
+from bson import ObjectId
+from database import db
+from ttl_cache import TTLCache
+import os
+
+# (user id, class id) -> "teacher", "student" or "none"
+membership_cache = TTLCache(int(os.getenv("MEMBERSHIP_CACHE_SIZE", "50000")),
+                            int(os.getenv("MEMBERSHIP_CACHE_TTL", "60")))
+# Negative answers expire sooner: a student who just joined through another
+# worker process must not be locked out for long
+negative_ttl = int(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "5"))
+
+
+def _load(user_id, class_id):
+    if db.classes.find_one({"_id": ObjectId(class_id), "teacherId": ObjectId(user_id)}, {"_id": 1}):
+        return "teacher"
+    if db.classMembers.find_one({"classId": ObjectId(class_id), "studentId": ObjectId(user_id)}, {"_id": 1}):
+        return "student"
+    return "none"
+
+
+def class_role(user_id, class_id):
+    """
+    How a user belongs to a class: "teacher", "student", or None if not at
+    all (or the class doesn't exist). Answers are cached per process, negative
+    ones only for `negative_ttl` seconds, so joining or deleting a class should
+    invalidate them.
+    """
+    key = (str(user_id), str(class_id))
+    role = membership_cache.get(key)
+    if role is None:
+        role = _load(user_id, class_id)
+        membership_cache.set(key, role, ttl=negative_ttl if role == "none" else None)
+    return None if role == "none" else role
+
+
+def invalidate_membership(user_id, class_id):
+    membership_cache.invalidate((str(user_id), str(class_id)))
+
+
+def invalidate_class(class_id):
+    """Forgets every cached membership of a class, e.g. once it is deleted."""
+    class_id = str(class_id)
+    membership_cache.invalidate_matching(lambda key: key[1] == class_id)
@@ -6,6 +6,9 @@ from database import db, fs  # Import db and fs from database.py
 # Import get_jwt_identity and jwt_required
 from flask_jwt_extended import get_jwt_identity, jwt_required
 from auth import role_required  # Import role_required from auth.py
+from jobs import executor
+from pdf_text import index_note
+from membership import class_role
 
 notes_bp = Blueprint("notes", __name__)
 
@@ -17,7 +20,7 @@ def upload_notes():
     data = request.form
     class_id = ObjectId(data["classId"])
 
-    if not db.classes.find_one({"_id": class_id, "teacherId": ObjectId(user_id)}):
+    if class_role(user_id, class_id) != "teacher":
         return jsonify({"error": "Unauthorized or class not found"}), 403
 
     title = data["title"]
@@ -40,6 +43,9 @@ def upload_notes():
         "uploaded_at": datetime.utcnow()
     }
     note_id = db.notes.insert_one(note).inserted_id
+    if content_type == "pdf":
+        # Build the page/topic index off the request path
+        executor.submit(index_note, note_id)
     return jsonify({"note_id": str(note_id)}), 201
 
 
@@ -50,8 +56,7 @@ def get_class_notes(class_id):
     class_id = ObjectId(class_id)
 
     # Check if user is part of the class
-    if not (db.classes.find_one({"_id": class_id, "teacherId": ObjectId(user_id)}) or
-            db.classMembers.find_one({"classId": class_id, "studentId": ObjectId(user_id)})):
+    if not class_role(user_id, class_id):
         return jsonify({"error": "Unauthorized or class not found"}), 403
 
     notes = db.notes.find({"classId": class_id})
@@ -80,8 +85,7 @@ def download_note(note_id):
 
     # Check if user is part of the class
     class_id = note["classId"]
-    if not (db.classes.find_one({"_id": class_id, "teacherId": ObjectId(user_id)}) or
-            db.classMembers.find_one({"classId": class_id, "studentId": ObjectId(user_id)})):
+    if not class_role(user_id, class_id):
         return jsonify({"error": "Unauthorized"}), 403
 
     if note["content_type"] != "pdf":
@@ -0,0 +1,118 @@
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from revocation import store
+import multiprocessing
+import threading
+import time
+import os
+
+# werkzeug method string, including its work factor; changing it rehashes on login
+hash_method = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+hash_workers = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# What werkzeug writes for hash_method, with its defaults filled in
+# (e.g. "pbkdf2:sha256" -> "pbkdf2:sha256:1000000")
+written_method = generate_password_hash("", hash_method).split("$", 1)[0]
+
+# Failed logins allowed per client IP, and per account from one IP, in fixed
+# windows of `failure_window` seconds. Counts live in Redis, shared by workers.
+max_account_failures = int(os.getenv("LOGIN_MAX_FAILURES_PER_ACCOUNT", "5"))
+max_ip_failures = int(os.getenv("LOGIN_MAX_FAILURES_PER_IP", "20"))
+failure_window = int(os.getenv("LOGIN_FAILURE_WINDOW", "900"))
+# Seconds every login to an account over its failure limit (counted from all
+# IPs) is held back. A delay, not a refusal, so others can't lock the owner out.
+account_failure_delay = float(os.getenv("LOGIN_FAILURE_DELAY", "2"))
+failure_key_prefix = "login_failures:"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _hashers():
+    # Hashing is deliberately CPU heavy; worker processes keep it off the
+    # request and Socket.IO threads and bound how many run at once
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Forking the threaded server can deadlock the children; start them fresh
+            _pool = ProcessPoolExecutor(
+                max_workers=hash_workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def hash_password(password):
+    return _hashers().submit(generate_password_hash, password, hash_method).result()
+
+
+def verify_password(password_hash, password):
+    return _hashers().submit(check_password_hash, password_hash, password).result()
+
+
+def needs_rehash(password_hash):
+    """True if the hash was made with a different method or work factor."""
+    return password_hash.split("$", 1)[0] != written_method
+
+
+def rehash_later(password, on_done):
+    """Hashes `password` with the current settings in the background; on_done(hash)."""
+    future = _hashers().submit(generate_password_hash, password, hash_method)
+    future.add_done_callback(
+        lambda f: on_done(f.result()) if f.exception() is None else None)
+
+
+def _failure_key(*parts):
+    # The window is part of the key, so expiring it can't make the window slide
+    window = int(time.time() // failure_window)
+    return failure_key_prefix + ":".join(str(p) for p in parts + (window,))
+
+
+def _failure_count(key):
+    try:
+        return int(store.get(key) or 0)
+    except Exception as e:
+        print(f"login throttle lookup failed: {e}")
+        return 0
+
+
+def _refusal_limits(ip, account):
+    if ip is None:
+        return []
+    return [(_failure_key("ip", ip), max_ip_failures),
+            (_failure_key("account", account.lower(), ip), max_account_failures)]
+
+
+def login_throttled(ip, account):
+    """
+    True while the client IP, or the account from that IP, has too many
+    recent failed logins. Pass ip=None when the client's address isn't known:
+    then nothing is refused and login_delay is all that applies.
+    """
+    return any(_failure_count(key) >= limit
+               for key, limit in _refusal_limits(ip, account))
+
+
+def login_delay(account):
+    """Seconds to hold back a login to an account with too many recent failures."""
+    if _failure_count(_failure_key("account", account.lower())) >= max_account_failures:
+        return account_failure_delay
+    return 0
+
+
+def record_login_failure(ip, account):
+    keys = [_failure_key("account", account.lower())]
+    keys += [key for key, _ in _refusal_limits(ip, account)]
+    try:
+        for key in keys:
+            store.incr(key)
+            store.expire(key, failure_window)
+    except Exception as e:
+        print(f"login throttle update failed: {e}")
+
+
+def clear_login_failures(ip, account):
+    """Forgets the account's failures from this IP after a successful login."""
+    if ip is None:
+        return
+    try:
+        store.delete(_failure_key("account", account.lower(), ip))
+    except Exception as e:
+        print(f"login throttle update failed: {e}")
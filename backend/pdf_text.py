@@ -0,0 +1,148 @@
+from google.genai import types
+from bson import ObjectId
+from database import db, fs
+from collections import Counter
+import fitz  # PyMuPDF
+import re
+import os
+
+# Pages with less extractable text than this are treated as image-heavy
+min_text_chars = int(os.getenv("PDF_MIN_TEXT_CHARS", "200"))
+# Pages whose embedded images cover more than this fraction are rasterized too
+max_image_coverage = float(os.getenv("PDF_MAX_IMAGE_COVERAGE", "0.5"))
+# Resolution used when a page has to be sent as an image
+raster_dpi = int(os.getenv("PDF_RASTER_DPI", "100"))
+# Approximate prompt cost of a page sent as an image
+image_tokens = 258
+# Topics recorded per page in the index
+topics_per_page = 8
+
+stopwords = set("""a about above after again against all also am an and any are as at be
+because been before being below between both but by can could did do does doing down
+during each either etc few for from further given had has have having he her here hers
+him his how however i if in into is it its itself just may me more most must my no nor
+not now of off on once only or other our ours out over own per same she should so some
+such than that the their them then there these they this those through thus to too
+under until up upon us use used using very was we were what when where which while who
+whom why will with within without would you your""".split())
+
+
+def _image_coverage(page):
+    page_area = abs(page.rect) or 1
+    covered = sum(abs(fitz.Rect(info["bbox"]) & page.rect)
+                  for info in page.get_image_info())
+    return min(covered / page_area, 1)
+
+
+def extract_pages(pdf_bytes):
+    """
+    Extracts each page's text. Pages that are mostly images (diagrams, scans)
+    are also rendered to PNG so they can be sent to the model as pictures.
+    Returns a list of {"page", "text", "image"} dicts, image being PNG bytes
+    or None.
+    """
+    pages = []
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        for page in doc:
+            text = page.get_text().strip()
+            image = None
+            if len(text) < min_text_chars or _image_coverage(page) > max_image_coverage:
+                zoom = raster_dpi / 72
+                image = page.get_pixmap(matrix=fitz.Matrix(
+                    zoom, zoom), alpha=False).tobytes("png")
+            pages.append({"page": page.number + 1, "text": text, "image": image})
+    return pages
+
+
+def estimate_tokens(text, has_image=False):
+    """Cheap token estimate (~4 characters per token) for budgeting."""
+    return len(text) // 4 + (image_tokens if has_image else 0)
+
+
+def detect_topics(text):
+    """
+    Keyword topics for a page: its heading-like lines plus its most frequent
+    non-stopword terms, lowercased.
+    """
+    headings = [line.strip().lower() for line in text.splitlines()
+                if 2 < len(line.strip()) < 60 and line.strip()[0].isupper()
+                and not line.strip().endswith(".")][:3]
+    words = [w for w in re.findall(r"[a-z][a-z\-]{2,}", text.lower())
+             if w not in stopwords]
+    frequent = [w for w, _ in Counter(words).most_common(topics_per_page)]
+    return list(dict.fromkeys(headings + frequent))[:topics_per_page]
+
+
+def get_note_pages(note, pdf_bytes=None):
+    """
+    Returns the page index for a PDF note: each page's text, detected topics,
+    token estimate and rasterized image (for image-heavy pages). The index is
+    built and cached on the note the first time; rasterized pages are kept in
+    GridFS and referenced by id.
+    """
+    if note.get("pages") is None:
+        if pdf_bytes is None:
+            pdf_bytes = fs.get(ObjectId(note["content"])).read()
+        stored = []
+        for page in extract_pages(pdf_bytes):
+            image_id = fs.put(page["image"]) if page["image"] else None
+            stored.append({"page": page["page"], "text": page["text"],
+                           "image_id": image_id,
+                           "topics": detect_topics(page["text"]),
+                           "tokens": estimate_tokens(page["text"], bool(image_id))})
+        db.notes.update_one({"_id": note["_id"]}, {"$set": {"pages": stored}})
+        note["pages"] = stored
+
+    return [{"page": p["page"], "text": p["text"],
+             "topics": p.get("topics") or detect_topics(p["text"]),
+             "tokens": p.get("tokens") or estimate_tokens(p["text"], bool(p["image_id"])),
+             "image": fs.get(p["image_id"]).read() if p["image_id"] else None}
+            for p in note["pages"]]
+
+
+def index_note(note_id):
+    """Builds a note's page index ahead of time (e.g. right after upload)."""
+    note = db.notes.find_one({"_id": ObjectId(note_id)})
+    if note and note["content_type"] == "pdf":
+        get_note_pages(note)
+
+
+def select_pages(pages, weak_topics=None, token_budget=None):
+    """
+    Picks the pages worth sending for a student. Pages are ranked by how many
+    of the student's weak topics they mention, then filled greedily up to
+    `token_budget`. Returned pages keep their original order. Without weak
+    topics or a budget every page is kept.
+    """
+    weak_topics = [t.lower() for t in weak_topics or []]
+
+    def relevance(page):
+        text = page["text"].lower()
+        return sum(1 for topic in weak_topics
+                   if topic in text or topic in page["topics"])
+
+    ranked = sorted(pages, key=lambda p: (-relevance(p), p["page"]))
+    if weak_topics and any(relevance(p) for p in pages):
+        # Only keep pages that actually cover a weak topic
+        ranked = [p for p in ranked if relevance(p)]
+    if token_budget:
+        chosen = []
+        used = 0
+        for page in ranked:
+            if used + page["tokens"] > token_budget and chosen:
+                continue
+            chosen.append(page)
+            used += page["tokens"]
+        ranked = chosen
+    return sorted(ranked, key=lambda p: p["page"])
+
+
+def pages_to_parts(pages):
+    """Builds model content parts: text pages inline, image-heavy pages as PNG."""
+    parts = []
+    for page in pages:
+        parts.append(f"--- Page {page['page']} ---\n{page['text']}")
+        if page["image"]:
+            parts.append(types.Part.from_bytes(
+                data=page["image"], mime_type="image/png"))
+    return parts
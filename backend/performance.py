@@ -0,0 +1,40 @@
+from bson import ObjectId
+from database import db
+
+db.studentPerformance.create_index("studentId")
+db.classMembers.create_index([("classId", 1), ("studentId", 1)])
+
+
+def class_performance(class_id):
+    """
+    One round trip for a whole class: joins classMembers to studentPerformance
+    and computes each student's correct/total ratio server-side. Returns a
+    list of {"student_id", "score", "weak_topics"} in membership order;
+    students without any recorded answers score 0.
+    """
+    pipeline = [
+        {"$match": {"classId": ObjectId(class_id)}},
+        {"$lookup": {"from": "studentPerformance", "localField": "studentId",
+                     "foreignField": "studentId", "as": "perf"}},
+        {"$project": {
+            "_id": 0,
+            "studentId": 1,
+            "topics": {"$ifNull": [{"$arrayElemAt": ["$perf.topics", 0]}, []]},
+            "weak_topics": {"$ifNull": [{"$arrayElemAt": ["$perf.weak_topics", 0]}, []]}
+        }},
+        {"$project": {
+            "studentId": 1,
+            "weak_topics": 1,
+            "correct": {"$sum": "$topics.correct"},
+            "total": {"$sum": "$topics.total"}
+        }},
+        {"$project": {
+            "studentId": 1,
+            "weak_topics": 1,
+            "score": {"$cond": [{"$gt": ["$total", 0]},
+                                {"$divide": ["$correct", "$total"]}, 0]}
+        }}
+    ]
+    return [{"student_id": str(row["studentId"]), "score": row["score"],
+             "weak_topics": row["weak_topics"]}
+            for row in db.classMembers.aggregate(pipeline)]
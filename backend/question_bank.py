@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, ReturnDocument
+from database import db
+import hashlib
+import os
+
+# How long a generated question set stays reusable
+bank_ttl = int(os.getenv("QUESTION_BANK_TTL", str(30 * 24 * 3600)))
+# Upper bound on stored question sets; least recently used ones go first
+bank_max_entries = int(os.getenv("QUESTION_BANK_MAX_ENTRIES", "5000"))
+# Granularity used to turn a 0-1 difficulty into a cache band
+bank_bands = int(os.getenv("QUESTION_BANK_BANDS", "10"))
+
+bank = db.questionBank
+bank.create_index([("key", ASCENDING)], unique=True)
+bank.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+bank.create_index([("last_used", ASCENDING)])
+
+def pdf_hash(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def difficulty_to_band(difficulty):
+    return min(int(float(difficulty) * bank_bands), bank_bands - 1)
+
+
+def bank_key(content_hash, difficulty, n, prompt_version):
+    return f"{content_hash}:{difficulty_to_band(difficulty)}:{n}:{prompt_version}"
+
+
+def lookup(key):
+    """Returns the cached questions for key, or None on a miss."""
+    entry = bank.find_one_and_update(
+        {"key": key, "expires_at": {"$gt": datetime.utcnow()}},
+        {"$set": {"last_used": datetime.utcnow()}, "$inc": {"hits": 1}},
+        return_document=ReturnDocument.AFTER)
+    return entry["questions"] if entry else None
+
+
+def store(key, questions):
+    now = datetime.utcnow()
+    bank.update_one(
+        {"key": key},
+        {"$set": {"questions": questions, "last_used": now,
+                  "expires_at": now + timedelta(seconds=bank_ttl)},
+         "$setOnInsert": {"created_at": now, "hits": 0}},
+        upsert=True)
+    _evict()
+
+
+def _evict():
+    excess = bank.estimated_document_count() - bank_max_entries
+    if excess <= 0:
+        return
+    stale = [e["_id"] for e in bank.find({}, {"_id": 1})
+             .sort("last_used", ASCENDING).limit(excess)]
+    bank.delete_many({"_id": {"$in": stale}})
@@ -1,19 +1,111 @@
 import json
 import time
-from google import genai
+import random
 from google.genai import types
 import pathlib
+import os
+import gemini_client
+import question_bank
+from key_locks import key_lock
+from pdf_text import pages_to_parts
 
-# Initialize the GenAI client
-client = genai.Client()
+# Bump whenever the prompt changes so cached question sets are not reused
+PROMPT_VERSION = 2
+MODEL = "gemini-2.0-flash"
+gemini_client.configure_model_from_env(MODEL, "GEMINI_TEXT")
 
+# Output budget a single multi-student response has to fit in
+max_output_tokens = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS", "8192"))
+# Rough output cost of one generated question, used to size multi-student chunks
+tokens_per_question = 150
+# How many times invalid or missing questions are asked for again
+repair_rounds = int(os.getenv("QUIZ_REPAIR_ROUNDS", "2"))
+options_per_question = 4
 
-def generate_questions(file_content,  n, perf_matrix, sid):
+QUESTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "question": {"type": "STRING"},
+        "options": {"type": "ARRAY", "items": {"type": "STRING"},
+                    "minItems": options_per_question, "maxItems": options_per_question},
+        "answer": {"type": "STRING"},
+        "topic": {"type": "STRING"},
+    },
+    "required": ["question", "options", "answer", "topic"],
+    "propertyOrdering": ["question", "options", "answer", "topic"],
+}
+QUIZ_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "student_id": {"type": "STRING"},
+        "questions": {"type": "ARRAY", "items": QUESTION_SCHEMA},
+    },
+    "required": ["student_id", "questions"],
+    "propertyOrdering": ["student_id", "questions"],
+}
+MULTI_QUIZ_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"quizzes": {"type": "ARRAY", "items": QUIZ_SCHEMA}},
+    "required": ["quizzes"],
+}
+
+
+def structured_config(schema=QUIZ_SCHEMA, **kwargs):
+    """Generation config that makes the model answer with JSON matching `schema`."""
+    return types.GenerateContentConfig(
+        response_mime_type="application/json", response_schema=schema, **kwargs)
+
+
+def generate_questions(file_content,  n, perf_matrix, sid, use_bank=True, pages=None):
     """
     Generates questions based on the provided file content.
+    Question sets are shared through the question bank, keyed by the PDF's
+    hash, difficulty band, question count and prompt version; each student
+    gets the shared set in their own question and option order.
+    If `pages` (from pdf_text.get_note_pages) is given, the extracted page text
+    is sent instead of the raw PDF.
+    """
+    if not use_bank:
+        return _generate_questions(file_content, n, perf_matrix, sid, pages)
+
+    version = PROMPT_VERSION
+    if pages:
+        # Different page selections make different question sets
+        version = f"{PROMPT_VERSION}-text-" + \
+            ",".join(str(p["page"]) for p in pages)
+    key = question_bank.bank_key(
+        question_bank.pdf_hash(file_content.getvalue()), perf_matrix, n, version)
+    # Concurrent misses for the same key (e.g. two students in the same band)
+    # make one model call instead of several
+    with key_lock(key):
+        questions = question_bank.lookup(key)
+        if questions is None:
+            questions = _generate_questions(
+                file_content, n, perf_matrix, sid, pages)["questions"]
+            question_bank.store(key, questions)
+    return {"student_id": sid,
+            "questions": personalize_questions(questions, n, f"{key}:{sid}")}
+
+
+def personalize_questions(questions, n, seed):
+    """
+    Derives one student's quiz from a shared question pool: a subset of `n`
+    questions with both question and option order shuffled. Deterministic for
+    a given seed so regenerating a student's quiz gives the same result.
     """
-    # Define the prompt for generating questions
-    prompt_text = f"""Using the following context from the PDF, generate {n} multiple-choice questions (MCQs) with a difficulty level of {perf_matrix}, where difficulty is rated from 0 to 1, with 0 being super easy and 1 being the highest level of difficulty.
+    rng = random.Random(seed)
+    picked = rng.sample(questions, min(n, len(questions)))
+    personalized = []
+    for q in picked:
+        options = list(q["options"])
+        rng.shuffle(options)
+        personalized.append({**q, "options": options})
+    return personalized
+
+
+def build_prompt(n, perf_matrix, sid):
+    """Prompt asking for `n` MCQs at difficulty `perf_matrix` for student `sid`."""
+    return f"""Using the following context from the PDF, generate {n} multiple-choice questions (MCQs) with a difficulty level of {perf_matrix}, where difficulty is rated from 0 to 1, with 0 being super easy and 1 being the highest level of difficulty.
 The questions should vary in length and context, and can be both simple and complex, including numerical questions if applicable.
 
 The output should be in the following JSON format:
@@ -39,21 +131,268 @@ The output should be in the following JSON format:
 - Format the response strictly as valid JSON.
 - Do not include explanations or extra text outside the JSON."""
 
-    # Call the model to generate questions
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=[
-            types.Part.from_bytes(
-                data=file_content.getvalue(),
-                mime_type='application/pdf',
-            ),
-            prompt_text
-        ]
-    )
-# Extract JSON from response
-    s1 = response.text.replace("```json\n", "")
+
+def build_context(file_content, pages=None):
+    """Content parts carrying the note: extracted pages if given, else the PDF."""
+    if pages:
+        return pages_to_parts(pages)
+    return [types.Part.from_bytes(
+        data=file_content.getvalue(),
+        mime_type='application/pdf',
+    )]
+
+
+def parse_response(text):
+    """Extracts the JSON payload from a model response."""
+    s1 = text.replace("```json\n", "")
     s2 = s1.replace("```", "")
-    x = json.loads(s2)
-    # with open('output.json', 'a') as outfile:
-    #    json.dump(x, outfile, indent=2)
-    return x
+    return json.loads(s2)
+
+
+def validate_question(question):
+    """Returns what is wrong with a generated question, or None if it is usable."""
+    if not isinstance(question, dict):
+        return "not an object"
+    for field in ("question", "answer", "topic"):
+        if not isinstance(question.get(field), str) or not question[field].strip():
+            return f"missing {field}"
+    options = question.get("options")
+    if not isinstance(options, list) or len(options) != options_per_question:
+        return f"needs exactly {options_per_question} options"
+    if not all(isinstance(o, str) and o.strip() for o in options):
+        return "empty option"
+    if len(set(options)) != len(options):
+        return "duplicate options"
+    if question["answer"] not in options:
+        return "answer is not one of the options"
+    return None
+
+
+def valid_questions(questions):
+    """The usable questions of a parsed response, in order."""
+    if not isinstance(questions, list):
+        return []
+    return [q for q in questions if validate_question(q) is None]
+
+
+def _request_questions(file_content, n, perf_matrix, sid, pages=None, avoid=()):
+    prompt_text = build_prompt(n, perf_matrix, sid)
+    if avoid:
+        prompt_text += "\n- Do not repeat any of these questions:\n" + \
+            "\n".join(f"  - {q['question']}" for q in avoid)
+    response = gemini_client.generate_content(
+        model=MODEL,
+        contents=build_context(file_content, pages) + [prompt_text],
+        config=structured_config()
+    )
+    return parse_response(response.text).get("questions")
+
+
+def repair_questions(file_content, questions, n, perf_matrix, sid, pages=None):
+    """
+    Keeps the valid questions and asks the model for replacements of only the
+    invalid or missing ones, for up to `repair_rounds` rounds. May return fewer
+    than `n` questions if the repairs keep failing.
+    """
+    questions = valid_questions(questions)[:n]
+    for _ in range(repair_rounds):
+        if len(questions) >= n:
+            break
+        try:
+            replacements = _request_questions(
+                file_content, n - len(questions), perf_matrix, sid, pages, avoid=questions)
+        except (ValueError, AttributeError) as e:
+            print(f"repair for {sid} failed: {e}")
+            continue
+        questions += valid_questions(replacements)[:n - len(questions)]
+    return questions
+
+
+def _generate_questions(file_content, n, perf_matrix, sid, pages=None):
+    questions = repair_questions(
+        file_content,
+        _request_questions(file_content, n, perf_matrix, sid, pages),
+        n, perf_matrix, sid, pages)
+    if not questions:
+        raise ValueError("No valid questions in model response")
+    return {"student_id": sid, "questions": questions}
+
+
+def multi_student_chunk_size(n):
+    """How many students' quizzes of `n` questions fit in one response."""
+    per_student = n * tokens_per_question + 50
+    # Leave headroom: a response cut off at the limit loses the whole chunk
+    return max(1, int(max_output_tokens * 0.8) // per_student)
+
+
+def build_multi_prompt(n, performance_scores):
+    """Prompt asking for one quiz of `n` MCQs per student, each at its own difficulty."""
+    students = "\n".join(f"- {sid}: difficulty {perf}"
+                         for sid, perf in performance_scores.items())
+    return f"""Using the following context from the PDF, generate a separate set of {n} multiple-choice questions (MCQs) for each of the students listed below, at that student's difficulty level, where difficulty is rated from 0 to 1, with 0 being super easy and 1 being the highest level of difficulty.
+The questions should vary in length and context, and can be both simple and complex, including numerical questions if applicable.
+
+Students:
+{students}
+
+The output should be in the following JSON format:
+{{
+    "quizzes": [
+        {{
+            "student_id": "<student_id>",
+            "questions": [
+                {{
+                    "question": "<Question text>",
+                    "options": ["<Option 1>", "<Option 2>", "<Option 3>", "<Option 4>"],
+                    "answer": "<Correct Answer>",
+                    "topic": "<Relevant Topic>"
+                }},
+                ...
+            ]
+        }},
+        ...
+    ]
+}}
+
+### Instructions:
+- Return exactly one entry per student, using the student ids given above.
+- Each question should only contain the question part: no additional information like For student <student_id>.
+- Ensure each question has exactly 4 answer options.
+- Provide the correct answer as one of the options.
+- Difficulty level: 0 => Super easy, 1 => Highest level.
+- Assign an appropriate topic to each question based on the content.
+- Format the response strictly as valid JSON.
+- Do not include explanations or extra text outside the JSON."""
+
+
+def generate_questions_multi(file_content, n, performance_scores, pages=None):
+    """
+    Generates quizzes for several students in one model call, so the note is
+    sent once per chunk instead of once per student. `performance_scores`
+    maps student id to difficulty and should hold at most
+    multi_student_chunk_size(n) students. Invalid questions in an entry are
+    repaired; students missing from the response are regenerated individually.
+    Returns (quizzes, failures): a list of {"student_id", "questions"} in the
+    given order, and a dict of student id to the error that stopped them.
+    """
+    quizzes = {}
+    try:
+        response = gemini_client.generate_content(
+            model=MODEL,
+            contents=build_context(file_content, pages) +
+            [build_multi_prompt(n, performance_scores)],
+            config=structured_config(
+                MULTI_QUIZ_SCHEMA, max_output_tokens=max_output_tokens)
+        )
+        for entry in parse_response(response.text).get("quizzes", []):
+            if isinstance(entry, dict) and isinstance(entry.get("questions"), list):
+                quizzes[str(entry.get("student_id"))] = entry["questions"]
+    except (ValueError, AttributeError) as e:
+        print(f"multi-student response unusable, falling back: {e}")
+
+    results = []
+    failures = {}
+    for sid, perf in performance_scores.items():
+        # One student's failed fallback must not cost the rest of the chunk
+        try:
+            questions = []
+            if sid in quizzes:
+                questions = repair_questions(
+                    file_content, quizzes[sid], n, perf, sid, pages)
+            if not questions:
+                questions = _generate_questions(
+                    file_content, n, perf, sid, pages)["questions"]
+        except Exception as e:
+            failures[sid] = str(e)
+            continue
+        results.append({"student_id": sid, "questions": questions})
+    return results, failures
+
+
+class QuestionStreamParser:
+    """
+    Incrementally extracts question objects from a streamed response of the
+    form {"student_id": ..., "questions": [{...}, {...}, ...]}. feed() returns
+    the questions completed by each new chunk of text, so a response cut off
+    half way still yields every question before the cut.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0            # next character to scan
+        self.in_array = False   # inside the "questions" array
+        self.depth = 0          # object nesting depth inside the array
+        self.in_string = False
+        self.escaped = False
+        self.start = None       # where the current question object began
+
+    def feed(self, text):
+        self.buffer += text
+        questions = []
+        if not self.in_array:
+            key = self.buffer.find('"questions"', self.pos)
+            bracket = self.buffer.find("[", key) if key != -1 else -1
+            if bracket == -1:
+                return questions
+            self.in_array = True
+            self.pos = bracket + 1
+
+        while self.pos < len(self.buffer):
+            c = self.buffer[self.pos]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif c == "\\":
+                    self.escaped = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c == "{":
+                if self.depth == 0:
+                    self.start = self.pos
+                self.depth += 1
+            elif c == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        questions.append(json.loads(
+                            self.buffer[self.start:self.pos + 1]))
+                    except ValueError:
+                        pass
+            self.pos += 1
+        return questions
+
+
+def generate_questions_stream(file_content, n, perf_matrix, sid, pages=None,
+                              on_question=None):
+    """
+    Streaming variant of generate_questions: on_question(question) is called as
+    soon as each valid question has been fully received. Invalid questions are
+    skipped and, like those lost when the stream breaks off, replaced through
+    repair_questions afterwards. Raises if the stream fails before any arrived.
+    """
+    parser = QuestionStreamParser()
+    questions = []
+    try:
+        for chunk in gemini_client.generate_content_stream(
+                model=MODEL,
+                contents=build_context(file_content, pages) +
+                [build_prompt(n, perf_matrix, sid)],
+                config=structured_config()):
+            for question in valid_questions(parser.feed(chunk.text or "")):
+                questions.append(question)
+                if on_question:
+                    on_question(question)
+    except Exception:
+        if not questions:
+            raise
+        print(f"stream for {sid} broke off after {len(questions)} questions")
+    for question in repair_questions(
+            file_content, questions, n, perf_matrix, sid, pages)[len(questions):]:
+        questions.append(question)
+        if on_question:
+            on_question(question)
+    if not questions:
+        raise ValueError("No questions in model response")
+    return {"student_id": sid, "questions": questions}
@@ -1,33 +1,584 @@
 from flask_jwt_extended import get_jwt_identity, jwt_required
 from flask import Blueprint, request, jsonify
 from bson import ObjectId
-from datetime import datetime
-from database import db, fs
+from datetime import datetime, timedelta
+from database import db, fs, run_in_transaction
+from pymongo import UpdateOne
 from auth import role_required
 from io import BytesIO
-from question_generator import generate_questions
+from question_generator import generate_questions, build_prompt, build_context, parse_response
+from question_generator import QUIZ_SCHEMA, valid_questions, personalize_questions
+from question_generator import generate_questions_multi, multi_student_chunk_size
+from question_generator import generate_questions_stream
+from extensions import socketio
+from jobs import create_job, update_job, get_job, submit_job, serialize_job
+from pdf_text import get_note_pages, select_pages
+from batch import get_backend, write_batch_file, read_batch_results
+from performance import class_performance
+from membership import class_role
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import math
+import tempfile
+import time
+import os
 
 quizzes_bp = Blueprint("quizzes", __name__)
 
+db.personalizedQuizzes.create_index(
+    [("quizAssignmentId", 1), ("studentId", 1)], unique=True)
+
 # Simulated Gemini API integration based on your data format
 
 number_of_questions = 5  # Number of questions to generate per student
 
+# Upper bound on concurrent Gemini calls made for a single generation request
+max_concurrent_generations = int(os.getenv("QUIZ_GEN_CONCURRENCY", "8"))
+# Seconds to wait for a single student's questions before giving up on them
+generation_timeout = float(os.getenv("QUIZ_GEN_TIMEOUT", "120"))
+# Number of difficulty bands used by the bucketed generation mode
+difficulty_bands = int(os.getenv("QUIZ_DIFFICULTY_BANDS", "5"))
+max_difficulty_bands = 20
+# How many questions each band's pool holds, relative to the quiz length
+band_pool_factor = 2
+# What the model receives for a note: "pdf" (the raw file) or "text" (extracted pages)
+default_payload = os.getenv("QUIZ_PAYLOAD_MODE", "pdf")
+payloads = ("pdf", "text", "targeted")
+# Generation modes; None generates one quiz per student
+modes = (None, "bucketed", "multi", "stream", "batch")
+# Modes whose model calls serve several students, so can't target one's weak topics
+shared_context_modes = ("bucketed", "multi")
+# Default input token budget for the "targeted" payload (0 = unlimited)
+default_token_budget = int(os.getenv("QUIZ_TOKEN_BUDGET", "0"))
+# The model's input context; larger budgets can't be met anyway
+max_token_budget = 1000000
+# Seconds between background polls of offline batches (0 = only when teachers poll)
+batch_poll_interval = float(os.getenv("QUIZ_BATCH_POLL_INTERVAL", "60"))
+# Seconds after which a batch still marked "ingesting" is assumed abandoned
+batch_ingest_timeout = int(os.getenv("QUIZ_BATCH_INGEST_TIMEOUT", "600"))
+
+_batch_poller = None
+
+
+def _fan_out(fn, items, max_workers, timeout):
+    """
+    Runs fn(item) for every item on a bounded thread pool and yields
+    (item, result, error) as each one finishes or is given up on. A call gets
+    `timeout` seconds from when it actually starts. Items still queued once
+    every item could have had its turn are dropped without being started.
+    """
+    started = {}
+
+    def run(item):
+        started[item] = time.monotonic()
+        return fn(item)
+
+    workers = min(max_workers, len(items))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    # Enough for every item to get a worker if calls keep within `timeout`
+    deadline = time.monotonic() + timeout * math.ceil(len(items) / workers)
+    try:
+        pending = {executor.submit(run, item): item for item in items}
+        while pending:
+            now = time.monotonic()
+            wake = min([deadline] + [started[item] + timeout
+                                     for item in pending.values() if item in started])
+            # Re-check at least every second: calls start while we wait
+            done, _ = wait(pending, timeout=min(max(wake - now, 0), 1),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    yield item, future.result(), None
+                except Exception as e:
+                    yield item, None, str(e)
+            now = time.monotonic()
+            for future, item in list(pending.items()):
+                if item in started and now - started[item] >= timeout:
+                    del pending[future]
+                    yield item, None, f"Timed out after {timeout}s"
+                elif now >= deadline and future.cancel():
+                    del pending[future]
+                    yield item, None, "Not started: every worker was busy until the deadline"
+    finally:
+        # Don't hold the request hostage to calls that already timed out
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def gemini_generate_quiz(pdf_path, n, students, performance_scores,
+                         max_workers=None, timeout=None, on_result=None,
+                         generate_options=None, generate=generate_questions,
+                         student_options=None):
+    """
+    Generates a quiz per student, fanning the Gemini calls out over a bounded
+    thread pool; each call may run for `timeout` seconds. Returns (quizzes,
+    failures) where quizzes keeps the order of `students` and failures maps a
+    student id to the error that stopped it.
+    If given, on_result(student, error) is called as each student finishes.
+    generate_options are passed through to `generate` (generate_questions by
+    default), merged with any per-student entry of student_options.
+    """
+    generate_options = generate_options or {}
+    student_options = student_options or {}
+    max_workers = max_workers or max_concurrent_generations
+    timeout = timeout or generation_timeout
+    quizzes = []
+    failures = {}
+    if not students:
+        return quizzes, failures
+
+    def run(student):
+        return generate(pdf_path, n, performance_scores[student], student,
+                        **{**generate_options, **student_options.get(student, {})})
+
+    generated = {}
+    for student, quiz_data, error in _fan_out(run, students, max_workers, timeout):
+        if error is None:
+            # Trust our own id over whatever the model echoed back
+            quiz_data["student_id"] = student
+            generated[student] = quiz_data
+        else:
+            failures[student] = error
+        if on_result:
+            on_result(student, error)
+    quizzes = [generated[student] for student in students if student in generated]
+
+    print(f"quizzes generated! ({len(quizzes)} ok, {len(failures)} failed)")
+    return quizzes, failures
+
+
+def difficulty_band(score, bands):
+    """Maps a 0-1 performance score to a band index in [0, bands)."""
+    return min(int(score * bands), bands - 1)
+
+
+def band_difficulty(band, bands):
+    """Difficulty sent to the model for a band: the middle of its range."""
+    return round((band + 0.5) / bands, 2)
+
+
+def bucketed_generate_quiz(pdf_path, n, students, performance_scores,
+                           bands=None, seed=None, on_result=None,
+                           generate_options=None):
+    """
+    Generates one question pool per difficulty band instead of one quiz per
+    student, then derives each student's quiz locally from their band's pool.
+    Passing the same seed derives the same quizzes from the same pools; without
+    one a random seed is used. Returns (quizzes, failures) like
+    gemini_generate_quiz.
+    """
+    bands = bands or difficulty_bands
+    seed = seed or os.urandom(8).hex()
+
+    members = {}
+    for student in students:
+        band = difficulty_band(performance_scores[student], bands)
+        members.setdefault(f"band-{band}", []).append(student)
+    band_scores = {key: band_difficulty(int(key.split("-")[1]), bands)
+                   for key in members}
+
+    def on_band_result(band, error):
+        if on_result:
+            for student in members[band]:
+                on_result(student, error)
+
+    pools, band_failures = gemini_generate_quiz(
+        pdf_path, n * band_pool_factor, list(members), band_scores,
+        on_result=on_band_result, generate_options=generate_options)
+    pools = {pool["student_id"]: pool["questions"] for pool in pools}
 
-def gemini_generate_quiz(pdf_path, n, students, performance_scores):
     quizzes = []
+    failures = {}
     for student in students:
-        quiz_data = generate_questions(
-            pdf_path, n, performance_scores[student], student)
-        quizzes.append(quiz_data)
-    print("quizzes generated!")
-    return quizzes
+        band = f"band-{difficulty_band(performance_scores[student], bands)}"
+        if band not in pools:
+            failures[student] = band_failures.get(band, "No questions generated")
+            continue
+        quizzes.append({
+            "student_id": student,
+            "questions": personalize_questions(pools[band], n, f"{seed}:{student}")
+        })
+    return quizzes, failures
+
+
+def multi_generate_quiz(pdf_path, n, students, performance_scores,
+                        max_workers=None, timeout=None, on_result=None,
+                        generate_options=None):
+    """
+    Generates quizzes for chunks of students with one model call per chunk,
+    sized to fit the output token limit. Chunks run concurrently on a bounded
+    pool. Returns (quizzes, failures) like gemini_generate_quiz.
+    """
+    generate_options = generate_options or {}
+    max_workers = max_workers or max_concurrent_generations
+    timeout = timeout or generation_timeout
+    size = multi_student_chunk_size(n)
+    chunks = [students[i:i + size] for i in range(0, len(students), size)]
+    quizzes = []
+    failures = {}
+    if not chunks:
+        return quizzes, failures
+
+    def run(index):
+        return generate_questions_multi(
+            pdf_path, n, {s: performance_scores[s] for s in chunks[index]},
+            **generate_options)
+
+    generated = {}
+    # A chunk may fall back to one call per student
+    for index, chunk_result, error in _fan_out(run, range(len(chunks)),
+                                               max_workers, timeout * 2):
+        results, chunk_failures = chunk_result or ([], {})
+        generated.update((q["student_id"], q) for q in results)
+        for student in chunks[index]:
+            if student not in generated:
+                failures[student] = chunk_failures.get(
+                    student, error or "No questions generated")
+            if on_result:
+                on_result(student, failures.get(student))
+    quizzes = [generated[student] for student in students if student in generated]
+
+    print(f"quizzes generated! ({len(quizzes)} ok, {len(failures)} failed)")
+    return quizzes, failures
+
+
+def create_quiz_assignment(class_id, note_id, deadline, quiz_id=None, session=None):
+    """Creates the assignment, leaving it untouched if quiz_id already exists."""
+    quiz_id = quiz_id or ObjectId()
+    quiz_assignment = {
+        "classId": class_id,
+        "noteId": note_id,
+        "deadline": deadline,
+        "created_at": datetime.utcnow()
+    }
+    db.quizAssignments.update_one({"_id": quiz_id}, {"$setOnInsert": quiz_assignment},
+                                  upsert=True, session=session)
+    return quiz_id
+
+
+def new_personalized_quiz(quiz_id, student_id, questions, deadline, status="ready"):
+    return {
+        "quizAssignmentId": quiz_id,
+        "studentId": ObjectId(student_id),
+        "questions": questions,  # Store full question data including answer and topic
+        "status": status,
+        "deadline": deadline,
+        "answers": None,
+        "score": None,
+        "submitted_at": None,
+        "feedback": None
+    }
+
+
+def _upsert_personalized_quiz(quiz_id, student_id, questions, deadline):
+    # Keyed by (quizAssignmentId, studentId): replaying it never adds a second quiz
+    quiz = new_personalized_quiz(quiz_id, student_id, questions, deadline)
+    key = {"quizAssignmentId": quiz.pop("quizAssignmentId"),
+           "studentId": quiz.pop("studentId")}
+    return UpdateOne(key, {"$setOnInsert": quiz}, upsert=True)
+
+
+def store_quiz_assignment(class_id, note_id, deadline, quizzes, quiz_id=None):
+    """
+    Stores the assignment and every student's personalized quiz in one
+    transaction, with a single unordered bulk write for the quizzes. Returns
+    the assignment id. All writes are upserts, so retrying with the same
+    quiz_id never duplicates anything.
+    """
+    quiz_id = quiz_id or ObjectId()
+
+    def write(session):
+        create_quiz_assignment(class_id, note_id, deadline, quiz_id, session=session)
+        if quizzes:
+            db.personalizedQuizzes.bulk_write(
+                [_upsert_personalized_quiz(quiz_id, q["student_id"], q["questions"], deadline)
+                 for q in quizzes],
+                ordered=False, session=session)
+
+    run_in_transaction(write)
+    return quiz_id
+
+
+def stream_student_quiz(pdf_path, n, perf_matrix, student, quiz_id=None,
+                        deadline=None, pages=None):
+    """
+    Streams one student's questions straight into their personalized quiz,
+    which stays in "generating" status until the stream ends, so the first
+    questions are readable while the rest are still being generated.
+    """
+    query = {"quizAssignmentId": quiz_id, "studentId": ObjectId(student)}
+    quiz = new_personalized_quiz(quiz_id, student, [], deadline, status="generating")
+    for key in ("quizAssignmentId", "studentId", "questions", "status"):
+        quiz.pop(key)
+    # A retried job restarts this student's stream from scratch
+    db.personalizedQuizzes.update_one(
+        query, {"$set": {"questions": [], "status": "generating"},
+                "$setOnInsert": quiz}, upsert=True)
+
+    def on_question(question):
+        db.personalizedQuizzes.update_one(
+            query, {"$push": {"questions": question}})
+
+    try:
+        quiz_data = generate_questions_stream(
+            pdf_path, n, perf_matrix, student, pages=pages, on_question=on_question)
+    except Exception:
+        db.personalizedQuizzes.delete_one(query)
+        raise
+    db.personalizedQuizzes.update_one(query, {"$set": {"status": "ready"}})
+    return quiz_data
+
+
+def run_quiz_generation(job_id, class_id, note_id, deadline, mode=None, bands=None,
+                        payload=None, token_budget=None):
+    """
+    Background half of /quizzes/generate: generates and stores every
+    student's quiz, reporting progress on the class's Socket.IO room.
+    """
+    room = str(class_id)
+    note = db.notes.find_one({"_id": note_id})
+
+    # Retrieve PDF content
+    pdf_file = fs.get(ObjectId(note["content"]))
+    pdf_path = BytesIO(pdf_file.read())
+    payload = payload or default_payload
+    token_budget = token_budget or default_token_budget
+    generate_options = {}
+    if payload in ("text", "targeted"):
+        pages = get_note_pages(note, pdf_path.getvalue())
+        generate_options["pages"] = select_pages(pages, token_budget=token_budget)
+
+    # Get students in the class along with their performance
+    performance = class_performance(class_id)
+    students = [row["student_id"] for row in performance]
+    performance_scores = {row["student_id"]: row["score"] for row in performance}
+
+    # Targeted payloads send each student only the pages on their weak topics
+    student_options = {}
+    if payload == "targeted":
+        student_options = {
+            row["student_id"]: {"pages": select_pages(pages, row["weak_topics"],
+                                                      token_budget)}
+            for row in performance}
+
+    progress = {"completed": 0, "total": len(students)}
+    update_job(job_id, progress=progress)
+
+    def on_result(student, error):
+        progress["completed"] += 1
+        update_job(job_id, progress=progress)
+        socketio.emit("quiz_job_progress", {
+            "job_id": str(job_id),
+            "student_id": student,
+            "status": "failed" if error else "generated",
+            **progress
+        }, room=room)
+
+    # Streamed quizzes are persisted question by question as they arrive
+    quiz_id = None
+    if mode == "stream":
+        quiz_id = create_quiz_assignment(
+            class_id, note_id, deadline, quiz_id=job_id)
+
+    # Generate personalized quizzes using your data format
+    try:
+        if mode == "stream":
+            quizzes, failures = gemini_generate_quiz(
+                pdf_path, number_of_questions, students, performance_scores,
+                on_result=on_result, generate=stream_student_quiz,
+                generate_options={**generate_options,
+                                  "quiz_id": quiz_id, "deadline": deadline},
+                student_options=student_options)
+        elif mode == "bucketed":
+            quizzes, failures = bucketed_generate_quiz(
+                pdf_path, number_of_questions, students, performance_scores,
+                bands=bands, seed=str(job_id), on_result=on_result,
+                generate_options=generate_options)
+        elif mode == "multi":
+            quizzes, failures = multi_generate_quiz(
+                pdf_path, number_of_questions, students, performance_scores,
+                on_result=on_result, generate_options=generate_options)
+        else:
+            quizzes, failures = gemini_generate_quiz(
+                pdf_path, number_of_questions, students, performance_scores,
+                on_result=on_result, generate_options=generate_options,
+                student_options=student_options)
+        if quiz_id is not None and failures:
+            # Timed-out streams may still be writing; drop their quizzes so
+            # what is stored matches the failures reported
+            db.personalizedQuizzes.delete_many({
+                "quizAssignmentId": quiz_id,
+                "studentId": {"$in": [ObjectId(s) for s in failures]}})
+        if students and not quizzes:
+            raise RuntimeError("Quiz generation failed for every student")
+    except Exception as e:
+        if quiz_id is not None:
+            db.personalizedQuizzes.delete_many({"quizAssignmentId": quiz_id})
+            db.quizAssignments.delete_one({"_id": quiz_id})
+        socketio.emit("quiz_job_failed", {
+            "job_id": str(job_id), "error": str(e)}, room=room)
+        raise
+
+    if quiz_id is None:
+        quiz_id = store_quiz_assignment(
+            class_id, note_id, deadline, quizzes, quiz_id=job_id)
+
+    result = {"quiz_assignment_id": str(quiz_id), "failures": failures}
+    socketio.emit("quiz_job_completed", {
+                  "job_id": str(job_id), **result}, room=room)
+    return result
+
+
+def submit_quiz_batch(user_id, class_id, note, deadline, payload=None, backend=None,
+                      token_budget=None):
+    """
+    Offline generation: writes one batch request per student and hands the
+    file to the batch backend. Results are ingested by ingest_quiz_batch.
+    """
+    payload = payload or default_payload
+    token_budget = token_budget or default_token_budget
+    pdf_path = BytesIO(fs.get(ObjectId(note["content"])).read())
+    pages = None
+    if payload in ("text", "targeted"):
+        pages = get_note_pages(note, pdf_path.getvalue())
+    context = build_context(pdf_path, pages)
+
+    performance = class_performance(class_id)
+    students = [row["student_id"] for row in performance]
+    performance_scores = {row["student_id"]: row["score"] for row in performance}
+    contexts = {student: context for student in students}
+    if payload == "targeted":
+        contexts = {row["student_id"]: build_context(
+            pdf_path, select_pages(pages, row["weak_topics"], token_budget))
+            for row in performance}
+
+    backend = get_backend(backend)
+    fd, input_path = tempfile.mkstemp(suffix=".jsonl")
+    os.close(fd)
+    try:
+        write_batch_file(input_path, ((student, contexts[student] + [build_prompt(
+            number_of_questions, performance_scores[student], student)])
+            for student in students),
+            generation_config={"responseMimeType": "application/json",
+                               "responseSchema": QUIZ_SCHEMA})
+        batch_id = backend.submit(input_path)
+    finally:
+        os.remove(input_path)
+
+    return db.quizBatches.insert_one({
+        "classId": class_id,
+        "noteId": note["_id"],
+        "teacherId": ObjectId(user_id),
+        "deadline": deadline,
+        "backend": backend.name,
+        "batchId": batch_id,
+        "students": students,
+        "status": "pending",
+        "quizAssignmentId": None,
+        "failures": {},
+        "created_at": datetime.utcnow()
+    }).inserted_id
+
+
+def ingest_quiz_batch(batch):
+    """
+    Polls a pending batch and, once it has succeeded, stores the results as a
+    quiz assignment. Returns the updated batch document.
+    """
+    if batch["status"] != "pending":
+        return batch
+    backend = get_backend(batch["backend"])
+    status = backend.status(batch["batchId"])
+    if status == "pending":
+        return batch
+    if status == "failed":
+        db.quizBatches.update_one({"_id": batch["_id"]}, {
+                                  "$set": {"status": "failed"}})
+        return {**batch, "status": "failed"}
+
+    # Claim the batch so concurrent pollers don't ingest it twice
+    if not db.quizBatches.update_one({"_id": batch["_id"], "status": "pending"},
+                                     {"$set": {"status": "ingesting",
+                                               "ingesting_at": datetime.utcnow()}}).modified_count:
+        return db.quizBatches.find_one({"_id": batch["_id"]})
+
+    try:
+        fields = _store_batch_results(batch, backend)
+    except Exception:
+        # Storing is idempotent, so the next poll can simply try again
+        db.quizBatches.update_one({"_id": batch["_id"], "status": "ingesting"},
+                                  {"$set": {"status": "pending"}})
+        raise
+    db.quizBatches.update_one({"_id": batch["_id"]}, {"$set": fields})
+    return {**batch, **fields}
+
+
+def _store_batch_results(batch, backend):
+    quizzes = []
+    failures = {}
+    for student, text, error in read_batch_results(backend.fetch_results(batch["batchId"])):
+        if student not in batch["students"]:
+            continue
+        if error is None:
+            try:
+                questions = valid_questions(parse_response(text)["questions"])
+                if questions:
+                    quizzes.append({"student_id": student, "questions": questions})
+                    continue
+                error = "No valid questions in response"
+            except (ValueError, KeyError, TypeError) as e:
+                error = f"Unparseable response: {e}"
+        failures[student] = error
+    missing = set(batch["students"]) - {q["student_id"] for q in quizzes}
+    for student in missing - set(failures):
+        failures[student] = "No result returned"
+
+    quiz_id = store_quiz_assignment(
+        batch["classId"], batch["noteId"], batch["deadline"], quizzes,
+        quiz_id=batch["_id"])
+    return {"status": "completed", "quizAssignmentId": quiz_id, "failures": failures}
+
+
+def poll_quiz_batches():
+    """
+    Ingests every pending batch that has finished, first releasing batches
+    whose ingest was abandoned (e.g. by a worker that died mid-way).
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=batch_ingest_timeout)
+    db.quizBatches.update_many({"status": "ingesting", "ingesting_at": {"$lt": cutoff}},
+                               {"$set": {"status": "pending"}})
+    for batch in db.quizBatches.find({"status": "pending"}):
+        try:
+            ingest_quiz_batch(batch)
+        except Exception as e:
+            print(f"quiz batch {batch['_id']} ingest failed: {e}")
+
+
+def _poll_batches_forever():
+    while True:
+        time.sleep(batch_poll_interval)
+        try:
+            # The local backend only makes progress when something runs it
+            if db.quizBatches.find_one({"status": "pending", "backend": "local"}):
+                get_backend("local").run_pending()
+            poll_quiz_batches()
+        except Exception as e:
+            print(f"quiz batch poll failed: {e}")
+
+
+def start_batch_poller():
+    """Starts the background thread that runs local batches and ingests finished ones."""
+    global _batch_poller
+    if batch_poll_interval > 0 and _batch_poller is None:
+        _batch_poller = threading.Thread(
+            target=_poll_batches_forever, name="quiz-batch-poller", daemon=True)
+        _batch_poller.start()
 
 
 @quizzes_bp.route("/generate", methods=["POST"])
 @role_required("teacher")
 def generate_quiz():
-    """Generate a quiz based on uploaded notes."""
+    """Queue quiz generation for uploaded notes; progress is pushed over Socket.IO."""
     user_id = get_jwt_identity()  # Assumes JWT is set up elsewhere
     data = request.json
     class_id = ObjectId(data["classId"])
@@ -35,7 +586,7 @@ def generate_quiz():
     deadline = datetime.fromisoformat(data["deadline"])
 
     # Verify teacher authorization
-    if not db.classes.find_one({"_id": class_id, "teacherId": ObjectId(user_id)}):
+    if class_role(user_id, class_id) != "teacher":
         return jsonify({"error": "Unauthorized or class not found"}), 403
 
     # Verify note exists and is a PDF
@@ -43,54 +594,67 @@ def generate_quiz():
     if not note or note["content_type"] != "pdf":
         return jsonify({"error": "Note not found or not a PDF"}), 404
 
-    # Retrieve PDF content
-    pdf_file = fs.get(ObjectId(note["content"]))
-    pdf_path = BytesIO(pdf_file.read())
+    mode = data.get("mode")
+    if mode not in modes:
+        return jsonify({"error": "Invalid mode"}), 400
+    payload = data.get("payload") or default_payload
+    if payload not in payloads:
+        return jsonify({"error": "Invalid payload"}), 400
+    if payload == "targeted" and mode in shared_context_modes:
+        return jsonify({"error": f"The targeted payload is not supported in {mode} mode"}), 400
+    try:
+        token_budget = int(data.get("token_budget", default_token_budget))
+    except (TypeError, ValueError):
+        token_budget = -1
+    if not 0 <= token_budget <= max_token_budget:
+        return jsonify({"error": f"token_budget must be an integer from 0 to {max_token_budget}"}), 400
+    if mode == "batch":
+        batch_id = submit_quiz_batch(user_id, class_id, note, deadline, payload=payload,
+                                     token_budget=token_budget)
+        return jsonify({"batch_id": str(batch_id)}), 202
+
+    try:
+        bands = int(data.get("bands", difficulty_bands))
+    except (TypeError, ValueError):
+        bands = 0
+    if not 1 <= bands <= max_difficulty_bands:
+        return jsonify({"error": f"bands must be an integer from 1 to {max_difficulty_bands}"}), 400
+    job_id = create_job("quiz_generation", user_id,
+                        classId=class_id, noteId=note_id)
+    submit_job(job_id, run_quiz_generation, class_id, note_id, deadline,
+               mode=mode, bands=bands, payload=payload,
+               token_budget=token_budget)
+    return jsonify({"job_id": str(job_id)}), 202
+
+
+@quizzes_bp.route("/jobs/<job_id>", methods=["GET"])
+@role_required("teacher")
+def get_generation_job(job_id):
+    """Report the status of a quiz generation job."""
+    user_id = get_jwt_identity()
+    job = get_job(job_id)
+    if not job or str(job["ownerId"]) != user_id:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(serialize_job(job)), 200
 
-    # Get students in the class
-    students = [str(member["studentId"])
-                for member in db.classMembers.find({"classId": class_id})]
-    performance_scores = {}
-    for student in students:
-        perf = db.studentPerformance.find_one({"studentId": ObjectId(student)})
-        if perf and perf.get("topics"):
-            total_correct = sum(topic["correct"] for topic in perf["topics"])
-            total_questions = sum(topic["total"] for topic in perf["topics"])
-            performance_scores[student] = total_correct / \
-                total_questions if total_questions > 0 else 0
-        else:
-            performance_scores[student] = 0
 
-    # Generate personalized quizzes using your data format
-    quizzes = gemini_generate_quiz(
-        pdf_path, number_of_questions, students, performance_scores)
+@quizzes_bp.route("/batches/<batch_id>", methods=["GET"])
+@role_required("teacher")
+def get_quiz_batch(batch_id):
+    """Report on an offline generation batch, ingesting its results once done."""
+    user_id = get_jwt_identity()
+    batch = db.quizBatches.find_one({"_id": ObjectId(batch_id)})
+    if not batch or str(batch["teacherId"]) != user_id:
+        return jsonify({"error": "Batch not found"}), 404
 
-    # Store quiz assignment
-    quiz_assignment = {
-        "classId": class_id,
-        "noteId": note_id,
-        "deadline": deadline,
-        "created_at": datetime.utcnow()
-    }
-    quiz_id = db.quizAssignments.insert_one(quiz_assignment).inserted_id
-
-    # Store personalized quizzes for each student
-    for quiz_data in quizzes:
-        student_id = quiz_data["student_id"]
-        questions = quiz_data["questions"]
-        personalized_quiz = {
-            "quizAssignmentId": quiz_id,
-            "studentId": ObjectId(student_id),
-            "questions": questions,  # Store full question data including answer and topic
-            "deadline": deadline,
-            "answers": None,
-            "score": None,
-            "submitted_at": None,
-            "feedback": None
-        }
-        db.personalizedQuizzes.insert_one(personalized_quiz)
-
-    return jsonify({"quiz_assignment_id": str(quiz_id)}), 201
+    batch = ingest_quiz_batch(batch)
+    quiz_id = batch["quizAssignmentId"]
+    return jsonify({
+        "batch_id": str(batch["_id"]),
+        "status": batch["status"],
+        "quiz_assignment_id": str(quiz_id) if quiz_id else None,
+        "failures": batch["failures"]
+    }), 200
 
 
 @quizzes_bp.route("/<quiz_id>", methods=["GET"])
@@ -106,7 +670,8 @@ def get_quiz(quiz_id):
     # Return only questions and options, hiding answers
     questions = [{"question": q["question"], "options": q["options"]}
                  for q in quiz["questions"]]
-    return jsonify({"questions": questions, "deadline": quiz["deadline"].isoformat()}), 200
+    return jsonify({"questions": questions, "status": quiz.get("status", "ready"),
+                    "deadline": quiz["deadline"].isoformat()}), 200
 
 
 @quizzes_bp.route("/<quiz_id>/submit", methods=["POST"])
@@ -119,6 +684,8 @@ def submit_quiz(quiz_id):
 
     if not quiz or quiz["submitted_at"]:
         return jsonify({"error": "Quiz not found or already submitted"}), 400
+    if quiz.get("status") == "generating":
+        return jsonify({"error": "Quiz is still being generated"}), 409
 
     answers = request.json["answers"]  # List of student answers
     feedback = request.json.get("feedback")
@@ -219,11 +786,11 @@ def get_class_quizzes(class_id):
     user_id = get_jwt_identity()
     class_id = ObjectId(class_id)
 
-    if not (db.classes.find_one({"_id": class_id, "teacherId": ObjectId(user_id)}) or
-            db.classMembers.find_one({"classId": class_id, "studentId": ObjectId(user_id)})):
+    role = class_role(user_id, class_id)
+    if not role:
         return jsonify({"error": "Unauthorized or class not found"}), 403
 
-    if str(db.classes.find_one({"_id": class_id})["teacherId"]) == user_id:
+    if role == "teacher":
         quizzes = db.quizAssignments.find({"classId": class_id})
         quiz_list = []
         for quiz in quizzes:
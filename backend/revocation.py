@@ -0,0 +1,237 @@
+import threading
+import hashlib
+import math
+import time
+import os
+
+redis_url = os.getenv("REDIS_URL")
+# Seconds between refreshes of each worker's bloom filter from Redis
+sync_interval = float(os.getenv("REVOCATION_SYNC_INTERVAL", "5"))
+bloom_capacity = int(os.getenv("REVOCATION_BLOOM_CAPACITY", "100000"))
+bloom_error_rate = float(os.getenv("REVOCATION_BLOOM_ERROR_RATE", "0.001"))
+
+# revoked:<jti> answers lookups; the sorted set (scored by expiry) feeds the bloom filters
+key_prefix = "revoked:"
+index_key = "revoked_jtis"
+# Sorted set of user ids scored by the time of their last identity change
+identity_changes_key = "identity_changes"
+# Kept for longer than any access token that could carry the old claims lives
+identity_change_retention = 24 * 3600
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the few Redis commands revocation and login
+    throttling use, for development and tests without a Redis server. Nothing
+    is shared between processes.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.sorted_sets = {}
+        self.lock = threading.Lock()
+
+    def set(self, name, value, ex=None):
+        with self.lock:
+            self.values[name] = (value, time.time() + ex if ex else None)
+        return True
+
+    def _live(self, name, now):
+        entry = self.values.get(name)
+        return entry is not None and (entry[1] is None or entry[1] > now)
+
+    def get(self, name):
+        with self.lock:
+            return self.values[name][0] if self._live(name, time.time()) else None
+
+    def incr(self, name):
+        with self.lock:
+            now = time.time()
+            value, expires = self.values[name] if self._live(name, now) else (0, None)
+            self.values[name] = (int(value) + 1, expires)
+            return int(value) + 1
+
+    def expire(self, name, seconds):
+        with self.lock:
+            if not self._live(name, time.time()):
+                return False
+            self.values[name] = (self.values[name][0], time.time() + seconds)
+            return True
+
+    def delete(self, *names):
+        with self.lock:
+            return sum(1 for name in names if self.values.pop(name, None) is not None)
+
+    def exists(self, *names):
+        now = time.time()
+        with self.lock:
+            return sum(1 for name in names if name in self.values and
+                       (self.values[name][1] is None or self.values[name][1] > now))
+
+    def zadd(self, name, mapping):
+        with self.lock:
+            self.sorted_sets.setdefault(name, {}).update(mapping)
+        return len(mapping)
+
+    def zrangebyscore(self, name, min, max, withscores=False):
+        lo = float("-inf") if min == "-inf" else float(min)
+        hi = float("inf") if max == "+inf" else float(max)
+        with self.lock:
+            members = self.sorted_sets.get(name, {})
+            found = sorted((m for m, s in members.items() if lo <= s <= hi),
+                           key=members.get)
+            return [(m, members[m]) for m in found] if withscores else found
+
+    def zremrangebyscore(self, name, min, max):
+        doomed = self.zrangebyscore(name, min, max)
+        with self.lock:
+            for member in doomed:
+                self.sorted_sets.get(name, {}).pop(member, None)
+        return len(doomed)
+
+
+class BloomFilter:
+    """Fixed-size bloom filter sized for `capacity` items at `error_rate`."""
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big")
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos // 8] |= 1 << (pos % 8)
+
+    def __contains__(self, item):
+        return all(self.bits[pos // 8] & (1 << (pos % 8)) for pos in self._positions(item))
+
+
+def _connect():
+    if not redis_url:
+        print("warning: REDIS_URL is not set; token revocations, identity changes "
+              "and login failures stay in this process and are not shared between workers")
+        return LocalRedis()
+    import redis
+    return redis.Redis.from_url(redis_url, decode_responses=True)
+
+
+store = _connect()
+_bloom = BloomFilter(bloom_capacity, bloom_error_rate)
+_bloom_lock = threading.Lock()
+# Revoked here but possibly missed by a sync that read Redis just before
+_unsynced = set()
+# user id -> time of their last identity change, as of this worker's last sync
+_identity_changes = {}
+_sync_thread = None
+
+
+def sync():
+    """
+    Rebuilds this worker's bloom filter from the unexpired revocations in
+    Redis, and refreshes its copy of recent identity changes.
+    """
+    global _bloom, _unsynced, _identity_changes
+    now = time.time()
+    store.zremrangebyscore(index_key, "-inf", now)
+    revoked = set(store.zrangebyscore(index_key, now, "+inf"))
+    bloom = BloomFilter(bloom_capacity, bloom_error_rate)
+    for jti in revoked:
+        bloom.add(jti)
+    with _bloom_lock:
+        for jti in _unsynced:
+            bloom.add(jti)
+        _unsynced = _unsynced - revoked
+        _bloom = bloom
+
+    cutoff = now - identity_change_retention
+    store.zremrangebyscore(identity_changes_key, "-inf", cutoff)
+    changes = dict(store.zrangebyscore(identity_changes_key, cutoff, "+inf",
+                                       withscores=True))
+    # Keep local changes a read made just before them may have missed
+    for user_id, changed_at in list(_identity_changes.items()):
+        if changed_at > max(cutoff, changes.get(user_id, 0)):
+            changes[user_id] = changed_at
+    _identity_changes = changes
+
+
+def _sync_forever():
+    while True:
+        time.sleep(sync_interval)
+        try:
+            sync()
+        except Exception as e:
+            print(f"revocation sync failed: {e}")
+
+
+def revoke(jwt_payload):
+    """Revokes a decoded token until it would have expired anyway."""
+    jti = jwt_payload["jti"]
+    expires = jwt_payload.get("exp") or time.time() + 24 * 3600
+    ttl = int(math.ceil(expires - time.time()))
+    if ttl <= 0:
+        return
+    store.set(key_prefix + jti, 1, ex=ttl)
+    store.zadd(index_key, {jti: expires})
+    with _bloom_lock:
+        _bloom.add(jti)
+        _unsynced.add(jti)
+
+
+def is_revoked(jwt_payload):
+    """
+    Most tokens are cleared by the local bloom filter; only possible hits (and
+    true revocations) cost a Redis lookup. A revocation made by another worker
+    takes effect here after at most `sync_interval` seconds. If Redis can't be
+    reached for a possible hit, the token is treated as revoked.
+    """
+    jti = jwt_payload["jti"]
+    with _bloom_lock:
+        maybe = jti in _bloom
+    if not maybe:
+        return False
+    try:
+        return bool(store.exists(key_prefix + jti))
+    except Exception as e:
+        print(f"revocation lookup failed: {e}")
+        return True
+
+
+def mark_identity_changed(user_id):
+    """
+    Records that a user's identity changed now. Other workers see it after at
+    most `sync_interval` seconds.
+    """
+    now = time.time()
+    store.zadd(identity_changes_key, {str(user_id): now})
+    _identity_changes[str(user_id)] = now
+
+
+def identity_changed_at(user_id):
+    """Time of the user's last recorded identity change, or 0."""
+    return _identity_changes.get(str(user_id), 0)
+
+
+def init_revocation(jwt):
+    """Hooks revocation checks into a JWTManager and fills the bloom filter once."""
+    @jwt.token_in_blocklist_loader
+    def check_if_token_revoked(jwt_header, jwt_payload):
+        return is_revoked(jwt_payload)
+
+    try:
+        sync()
+    except Exception as e:
+        print(f"revocation sync failed: {e}")
+
+
+def start_revocation_sync():
+    """Starts the background thread that keeps the bloom filter in sync."""
+    global _sync_thread
+    if _sync_thread is None:
+        _sync_thread = threading.Thread(
+            target=_sync_forever, name="revocation-sync", daemon=True)
+        _sync_thread.start()
@@ -0,0 +1,163 @@
+"""
+Benchmarks the quiz generation pipeline end to end (run_quiz_generation, the
+background half of POST /quizzes/generate) without touching the live API or
+a real database. Gemini is replaced by a client that replays recorded
+questions with configurable latency, MongoDB/GridFS by in-memory stand-ins.
+
+Sweeps class size, PDF size, concurrency and generation mode, and reports
+p50/p95 latency, model calls, bytes sent to the model and database
+operations per run.
+
+    python benchmarks/bench_quiz_pipeline.py --class-sizes 10,40 --pdf-pages 5,40
+"""
+from datetime import datetime, timedelta
+import statistics
+import itertools
+import argparse
+import random
+import types
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes  # noqa: E402
+
+topics = ["calculus", "algebra", "probability", "geometry"]
+
+
+def install_fakes(recorded_path, latency, jitter, rpm):
+    """Swaps the database module and Gemini client for local stand-ins."""
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ["GEMINI_RPM"] = str(rpm)
+    database = types.ModuleType("database")
+    database.client = fakes.FakeClient()
+    database.db = database.client["classroom_db"]
+    database.fs = fakes.FakeGridFS()
+    database.run_in_transaction = lambda callback: callback(None)
+    sys.modules["database"] = database
+
+    import gemini_client
+    import quizzes
+
+    gemini = fakes.FakeGeminiClient(
+        fakes.load_recorded_questions(recorded_path), latency, jitter)
+    gemini_client.client = gemini
+    quizzes.socketio = fakes.NullSocketIO()
+    return database, gemini, quizzes
+
+
+def make_pdf(pages):
+    import fitz
+    doc = fitz.open()
+    words = ("equation derivative integral limit matrix vector series "
+             "probability theorem proof function sequence").split()
+    rng = random.Random(pages)
+    for i in range(pages):
+        page = doc.new_page()
+        topic = topics[i % len(topics)]
+        text = f"Section {i + 1}: {topic.title()}\n" + "\n".join(
+            " ".join(rng.choice(words + [topic]) for _ in range(12)) for _ in range(40))
+        page.insert_text((50, 60), text, fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def seed_class(database, students, pdf_bytes):
+    db = database.db
+    teacher_id = db.users.insert_one({"role": "teacher"}).inserted_id
+    class_id = db.classes.insert_one(
+        {"subject": "Bench", "teacherId": teacher_id}).inserted_id
+    rng = random.Random(students)
+    for _ in range(students):
+        student_id = db.users.insert_one({"role": "student"}).inserted_id
+        db.classMembers.insert_one(
+            {"classId": class_id, "studentId": student_id})
+        total = rng.randint(5, 50)
+        db.studentPerformance.insert_one({
+            "studentId": student_id,
+            "topics": [{"topic": topic, "correct": rng.randint(0, total), "total": total}
+                       for topic in topics],
+            "weak_topics": [rng.choice(topics)]
+        })
+    note_id = db.notes.insert_one({
+        "classId": class_id, "teacherId": teacher_id, "title": "Bench notes",
+        "content": str(database.fs.put(pdf_bytes)), "content_type": "pdf"
+    }).inserted_id
+    return teacher_id, class_id, note_id
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def run(args):
+    database, gemini, quizzes = install_fakes(
+        args.recorded, args.latency, args.jitter, args.rpm)
+    from jobs import create_job
+
+    print(f"{'mode':<10} {'payload':<8} {'students':>8} {'pages':>5} {'conc':>4} "
+          f"{'p50 s':>7} {'p95 s':>7} {'calls':>6} {'MB sent':>8} {'db ops':>7} {'peak':>5}")
+    for pages, students, concurrency, mode in itertools.product(
+            args.pdf_pages, args.class_sizes, args.concurrency, args.modes):
+        pdf_bytes = open(args.pdf, "rb").read() if args.pdf else make_pdf(pages)
+        teacher_id, class_id, note_id = seed_class(database, students, pdf_bytes)
+        quizzes.max_concurrent_generations = concurrency
+
+        latencies, calls, sent, ops, peak = [], [], [], [], []
+        for _ in range(args.repeats):
+            if not args.warm_bank:
+                database.db.questionBank.delete_many({})
+            gemini.reset()
+            ops_before = database.db.operations
+            job_id = create_job("quiz_generation", teacher_id)
+            start = time.perf_counter()
+            quizzes.run_quiz_generation(
+                job_id, class_id, note_id, datetime.utcnow() + timedelta(days=1),
+                mode=None if mode == "student" else mode,
+                bands=args.bands, payload=args.payload)
+            latencies.append(time.perf_counter() - start)
+            calls.append(gemini.calls)
+            sent.append(gemini.bytes_sent)
+            ops.append(database.db.operations - ops_before)
+            peak.append(gemini.max_in_flight)
+
+        print(f"{mode:<10} {args.payload:<8} {students:>8} {pages if not args.pdf else '-':>5} "
+              f"{concurrency:>4} {percentile(latencies, 50):>7.2f} "
+              f"{percentile(latencies, 95):>7.2f} {statistics.mean(calls):>6.0f} "
+              f"{statistics.mean(sent) / 1e6:>8.2f} {statistics.mean(ops):>7.0f} "
+              f"{max(peak):>5}")
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--class-sizes", type=int_list, default=[10, 40])
+    parser.add_argument("--pdf-pages", type=int_list, default=[5, 40])
+    parser.add_argument("--pdf", help="benchmark a real PDF instead of synthetic ones")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 8])
+    parser.add_argument("--modes", type=lambda v: v.split(","), default=["student", "bucketed"],
+                        help="comma separated: student, bucketed, multi, stream")
+    parser.add_argument("--payload", default="pdf", choices=["pdf", "text", "targeted"])
+    parser.add_argument("--bands", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.5,
+                        help="seconds per fake model call")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--rpm", type=int, default=100000,
+                        help="requests per minute allowed by the shared Gemini client")
+    parser.add_argument("--recorded", default=os.path.join(ROOT, "output.json"),
+                        help="recorded model output to replay")
+    parser.add_argument("--warm-bank", action="store_true",
+                        help="keep the question bank between repeats")
+    run(parser.parse_args())
@@ -0,0 +1,530 @@
+"""
+Local stand-ins used by the benchmarks: an in-memory MongoDB/GridFS covering
+the operations the backend uses, and a Gemini client that replays recorded
+model output with configurable latency while counting calls and bytes sent.
+"""
+from bson import ObjectId
+from datetime import datetime
+from io import BytesIO
+import threading
+import hashlib
+import random
+import copy
+import json
+import time
+import re
+
+
+# ---------------------------------------------------------------------------
+# MongoDB
+
+def _get(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None
+        doc = doc[part]
+    return doc
+
+
+def _set(doc, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def _compare(val, op, arg):
+    values = val if isinstance(val, list) else [val]
+    if op == "$in":
+        return any(v in arg for v in values)
+    if op == "$nin":
+        return not any(v in arg for v in values)
+    if op == "$ne":
+        return val != arg
+    if op == "$exists":
+        return (val is not None) == arg
+    if op == "$eq":
+        return val == arg
+    if val is None:
+        return False
+    return {"$gt": val > arg, "$gte": val >= arg,
+            "$lt": val < arg, "$lte": val <= arg}[op]
+
+
+def matches(doc, query):
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+        elif isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+            val = _get(doc, key)
+            if not all(_compare(val, op, arg) for op, arg in cond.items()):
+                return False
+        else:
+            val = _get(doc, key)
+            if val != cond and not (isinstance(val, list) and cond in val):
+                return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    include = {k for k, v in projection.items() if v}
+    if include:
+        out = {k: copy.deepcopy(doc[k]) for k in include if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            out["_id"] = doc["_id"]
+        return out
+    return {k: copy.deepcopy(v) for k, v in doc.items() if k not in projection}
+
+
+def apply_update(doc, update, inserting=False):
+    for op, fields in update.items():
+        for key, value in fields.items():
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                _set(doc, key, copy.deepcopy(value))
+            elif op == "$unset":
+                doc.pop(key, None)
+            elif op == "$inc":
+                _set(doc, key, (_get(doc, key) or 0) + value)
+            elif op == "$push":
+                current = _get(doc, key) or []
+                current.append(copy.deepcopy(value))
+                _set(doc, key, current)
+
+
+def _resolve(doc, path):
+    """Field path lookup that maps over arrays, like "$items.price" does."""
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, list):
+            value = [v.get(part) for v in value if isinstance(v, dict) and part in v]
+        elif isinstance(value, dict):
+            value = value.get(part)
+        else:
+            return None
+    return value
+
+
+def evaluate(expr, doc):
+    """The subset of aggregation expressions the backend's pipelines use."""
+    if isinstance(expr, str) and expr.startswith("$"):
+        return _resolve(doc, expr[1:])
+    if isinstance(expr, list):
+        return [evaluate(e, doc) for e in expr]
+    if not isinstance(expr, dict) or not expr:
+        return expr
+    (op, args), = expr.items()
+    if not op.startswith("$"):
+        return {k: evaluate(v, doc) for k, v in expr.items()}
+    if op == "$literal":
+        return args
+    args = args if isinstance(args, list) else [args]
+    if op == "$cond":
+        return evaluate(args[1] if evaluate(args[0], doc) else args[2], doc)
+    values = [evaluate(a, doc) for a in args]
+    if op == "$ifNull":
+        return next((v for v in values if v is not None), None)
+    if op == "$arrayElemAt":
+        array, index = values
+        return array[index] if array and -len(array) <= index < len(array) else None
+    if op == "$sum":
+        flat = values[0] if len(values) == 1 and isinstance(values[0], list) else values
+        return sum(v for v in flat if isinstance(v, (int, float)))
+    if op == "$divide":
+        return values[0] / values[1]
+    if op in ("$gt", "$gte", "$lt", "$lte", "$eq", "$ne"):
+        return _compare(values[0], op, values[1])
+    if op == "$in":
+        return values[0] in values[1]
+    raise NotImplementedError(op)
+
+
+def _project_stage(doc, spec):
+    out = {}
+    if spec.get("_id", 1) and "_id" in doc:
+        out["_id"] = doc["_id"]
+    for key, expr in spec.items():
+        if key == "_id" and expr in (0, 1, True, False):
+            continue
+        if expr in (1, True):
+            value = _resolve(doc, key)
+            if value is not None:
+                _set(out, key, copy.deepcopy(value))
+        elif expr not in (0, False):
+            _set(out, key, evaluate(expr, doc))
+    return out
+
+
+class InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class UpdateResult:
+    def __init__(self, matched, modified, upserted_id=None):
+        self.matched_count = matched
+        self.modified_count = modified
+        self.upserted_id = upserted_id
+
+
+class DeleteResult:
+    def __init__(self, deleted):
+        self.deleted_count = deleted
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction=1):
+        if isinstance(key, list):
+            for k, d in reversed(key):
+                self.sort(k, d)
+            return self
+        self.docs.sort(key=lambda d: (_get(d, key) is None, _get(d, key)),
+                       reverse=direction < 0)
+        return self
+
+    def skip(self, n):
+        self.docs = self.docs[n:]
+        return self
+
+    def limit(self, n):
+        if n:
+            self.docs = self.docs[:n]
+        return self
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class FakeCollection:
+    def __init__(self, name, database=None):
+        self.name = name
+        self.database = database
+        self.docs = []
+        self.lock = threading.RLock()
+        self.ops = 0
+
+    def create_index(self, keys, **kwargs):
+        return str(keys)
+
+    def _count_op(self):
+        self.ops += 1
+
+    def find(self, query=None, projection=None, **kwargs):
+        self._count_op()
+        with self.lock:
+            return FakeCursor([_project(d, projection) for d in self.docs
+                               if matches(d, query or {})])
+
+    def find_one(self, query=None, projection=None, **kwargs):
+        for doc in self.find(query, projection):
+            return doc
+        return None
+
+    def count_documents(self, query):
+        return len(self.find(query).docs)
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+    def insert_one(self, doc, **kwargs):
+        self._count_op()
+        with self.lock:
+            doc.setdefault("_id", ObjectId())
+            self.docs.append(copy.deepcopy(doc))
+            return InsertOneResult(doc["_id"])
+
+    def insert_many(self, docs, **kwargs):
+        self._count_op()
+        with self.lock:
+            ids = []
+            for doc in docs:
+                doc.setdefault("_id", ObjectId())
+                self.docs.append(copy.deepcopy(doc))
+                ids.append(doc["_id"])
+            return type("InsertManyResult", (), {"inserted_ids": ids})()
+
+    def update_one(self, query, update, upsert=False, **kwargs):
+        self._count_op()
+        with self.lock:
+            for doc in self.docs:
+                if matches(doc, query):
+                    apply_update(doc, update)
+                    return UpdateResult(1, 1)
+            if not upsert:
+                return UpdateResult(0, 0)
+            doc = {k: v for k, v in query.items()
+                   if not k.startswith("$") and not isinstance(v, dict)}
+            doc["_id"] = doc.get("_id", ObjectId())
+            apply_update(doc, update, inserting=True)
+            self.docs.append(doc)
+            return UpdateResult(0, 0, doc["_id"])
+
+    def update_many(self, query, update, **kwargs):
+        self._count_op()
+        with self.lock:
+            hits = [d for d in self.docs if matches(d, query)]
+            for doc in hits:
+                apply_update(doc, update)
+            return UpdateResult(len(hits), len(hits))
+
+    def find_one_and_update(self, query, update, upsert=False,
+                            return_document=False, **kwargs):
+        with self.lock:
+            before = self.find_one(query)
+            result = self.update_one(query, update, upsert=upsert)
+            if return_document:
+                return self.find_one({"_id": before["_id"] if before else result.upserted_id})
+            return before
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        self._count_op()
+        with self.lock:
+            ops = self.ops
+            for request in requests:
+                # pymongo's UpdateOne keeps its arguments in private attributes
+                self.update_one(request._filter, request._doc, upsert=request._upsert)
+            self.ops = ops
+        return type("BulkWriteResult", (), {"acknowledged": True})()
+
+    def aggregate(self, pipeline, **kwargs):
+        self._count_op()
+        with self.lock:
+            docs = [copy.deepcopy(d) for d in self.docs]
+        for stage in pipeline:
+            (op, spec), = stage.items()
+            if op == "$match":
+                docs = [d for d in docs if matches(d, spec)]
+            elif op == "$lookup":
+                other = self.database[spec["from"]]
+                for d in docs:
+                    d[spec["as"]] = [copy.deepcopy(o) for o in other.docs
+                                     if o.get(spec["foreignField"]) == _get(d, spec["localField"])]
+            elif op == "$project":
+                docs = [_project_stage(d, spec) for d in docs]
+            elif op == "$unwind":
+                path = spec if isinstance(spec, str) else spec["path"]
+                docs = [{**d, path[1:]: v} for d in docs for v in (_get(d, path[1:]) or [])]
+            elif op == "$replaceRoot":
+                docs = [evaluate(spec["newRoot"], d) for d in docs]
+            elif op == "$sort":
+                cursor = FakeCursor(docs).sort(list(spec.items()))
+                docs = cursor.docs
+            elif op == "$skip":
+                docs = docs[spec:]
+            elif op == "$limit":
+                docs = docs[:spec]
+            else:
+                raise NotImplementedError(op)
+        return FakeCursor(docs)
+
+    def delete_one(self, query, **kwargs):
+        self._count_op()
+        with self.lock:
+            for i, doc in enumerate(self.docs):
+                if matches(doc, query):
+                    del self.docs[i]
+                    return DeleteResult(1)
+            return DeleteResult(0)
+
+    def delete_many(self, query, **kwargs):
+        self._count_op()
+        with self.lock:
+            keep = [d for d in self.docs if not matches(d, query)]
+            deleted = len(self.docs) - len(keep)
+            self.docs = keep
+            return DeleteResult(deleted)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, self)
+        return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    @property
+    def operations(self):
+        return sum(c.ops for c in self.collections.values())
+
+
+class FakeClient:
+    def __init__(self):
+        self.databases = {}
+
+    def __getitem__(self, name):
+        return self.databases.setdefault(name, FakeDatabase())
+
+
+class FakeGridOut(BytesIO):
+    def __init__(self, file_id, data, metadata):
+        super().__init__(data)
+        self._id = file_id
+        self.length = len(data)
+        self.upload_date = metadata.pop("upload_date")
+        self.content_type = metadata.get("content_type")
+        self.md5 = hashlib.md5(data).hexdigest()
+        self.metadata = metadata.get("metadata")
+
+
+class FakeGridFS:
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def put(self, data, **kwargs):
+        if hasattr(data, "read"):
+            data = data.read()
+        file_id = kwargs.pop("_id", None) or ObjectId()
+        with self.lock:
+            self.files[file_id] = (bytes(data), {**kwargs, "upload_date": datetime.utcnow()})
+        return file_id
+
+    def get(self, file_id):
+        data, metadata = self.files[file_id]
+        return FakeGridOut(file_id, data, dict(metadata))
+
+    def exists(self, file_id):
+        return file_id in self.files
+
+    def delete(self, file_id):
+        self.files.pop(file_id, None)
+
+
+# ---------------------------------------------------------------------------
+# Gemini
+
+def load_recorded_questions(path):
+    """Every question found in a file of concatenated JSON dumps (output.json)."""
+    text = open(path).read()
+    decoder = json.JSONDecoder()
+    questions = []
+    pos = 0
+    while pos < len(text):
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        if pos >= len(text):
+            break
+        obj, pos = decoder.raw_decode(text, pos)
+        questions.extend(obj.get("questions", []))
+    return questions
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModels:
+    def __init__(self, client):
+        self.client = client
+
+    def _questions(self, n, salt):
+        recorded = self.client.recorded
+        out = []
+        for i in range(n):
+            q = dict(recorded[i % len(recorded)])
+            q["question"] = f"{q['question']} [{salt}-{i}]"
+            out.append(q)
+        return out
+
+    def _answer(self, contents):
+        prompt = next(c for c in reversed(contents) if isinstance(c, str))
+        n = int(re.search(r"(?:generate|set of) (\d+) multiple-choice", prompt).group(1))
+        students = re.findall(r"^- (\S+): difficulty", prompt, re.M)
+        if students:
+            body = {"quizzes": [{"student_id": s, "questions": self._questions(n, s)}
+                                for s in students]}
+        else:
+            sid = re.search(r'"student_id": "([^"]*)"', prompt)
+            sid = sid.group(1) if sid else "student"
+            body = {"student_id": sid, "questions": self._questions(n, sid)}
+        return "```json\n" + json.dumps(body, indent=2) + "```"
+
+    def _record(self, contents):
+        sent = 0
+        for part in contents:
+            if isinstance(part, str):
+                sent += len(part.encode())
+            elif getattr(part, "inline_data", None) is not None:
+                sent += len(part.inline_data.data)
+            elif getattr(part, "text", None):
+                sent += len(part.text.encode())
+        with self.client.lock:
+            self.client.calls += 1
+            self.client.bytes_sent += sent
+            self.client.in_flight += 1
+            self.client.max_in_flight = max(self.client.max_in_flight, self.client.in_flight)
+
+    def _sleep(self):
+        time.sleep(max(0, self.client.latency +
+                       self.client.rng.uniform(-1, 1) * self.client.jitter))
+
+    def generate_content(self, model, contents, config=None):
+        contents = contents if isinstance(contents, list) else [contents]
+        self._record(contents)
+        try:
+            self._sleep()
+            return FakeResponse(self._answer(contents))
+        finally:
+            with self.client.lock:
+                self.client.in_flight -= 1
+
+    def generate_content_stream(self, model, contents, config=None):
+        contents = contents if isinstance(contents, list) else [contents]
+        self._record(contents)
+        try:
+            text = self._answer(contents)
+            chunks = [text[i:i + 256] for i in range(0, len(text), 256)]
+            for chunk in chunks:
+                time.sleep(max(0, self.client.latency / len(chunks)))
+                yield FakeResponse(chunk)
+        finally:
+            with self.client.lock:
+                self.client.in_flight -= 1
+
+
+class FakeGeminiClient:
+    """
+    Stands in for genai.Client(). Every call sleeps `latency` +/- `jitter`
+    seconds and answers with recorded questions, in the requested format.
+    """
+
+    def __init__(self, recorded, latency=0.5, jitter=0.1, seed=0):
+        self.recorded = recorded
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.models = FakeModels(self)
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.bytes_sent = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+class NullSocketIO:
+    """Swallows Socket.IO emits so pipeline code can run without a server."""
+
+    def __init__(self):
+        self.events = 0
+
+    def emit(self, *args, **kwargs):
+        self.events += 1